@@ -0,0 +1,35 @@
+# Compares item size and decode time of the "full" and "compact" anime-cache
+# storage formats.
+#
+#   python benchmarks/anime_cache_storage.py [--items 200]
+import argparse
+import timeit
+
+from fixtures import make_anime_details
+
+from anime_cache import decode_item, dynamodb_item_size, encode_item
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    details = [make_anime_details(mal_id) for mal_id in range(1, args.items + 1)]
+    print(f'{args.items} synthetic anime-cache items')
+    for storage_format in ('full', 'compact'):
+        items = [encode_item(anime, storage_format) for anime in details]
+        sizes = [dynamodb_item_size(item) for item in items]
+        seconds = min(timeit.repeat(lambda: [decode_item(item) for item in items], number=1, repeat=args.repeat))
+        # Reads are billed per started 4 KB
+        rcus = sum((size + 4095) // 4096 for size in sizes)
+        print(
+            f'{storage_format:<8} {sum(sizes) / len(sizes):>9,.0f} B avg {max(sizes):>9,} B max '
+            f'{rcus / 2:>8.1f} RCU per eventually consistent read of all '
+            f'{seconds / len(items) * 1e6:>8.1f} us decode per item'
+        )
+
+
+if __name__ == '__main__':
+    main()
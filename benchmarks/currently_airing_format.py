@@ -0,0 +1,43 @@
+# Compares the size and parse time of the original currentlyAiring.json with
+# the normalized currentlyAiring.v2.json built from the same data.
+#
+#   python benchmarks/currently_airing_format.py currentlyAiring.json
+#
+# The input is a copy of the original format, e.g. downloaded from
+# https://animedubstatus.com/currentlyAiring.json
+import argparse
+import gzip
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'dubInfoDownloader'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'layers', 'animeCache', 'python'))
+
+from currently_airing import buildCurrentlyAiring, buildLegacyCurrentlyAiring, splitLegacyCurrentlyAiring
+
+
+def measure(name, body, repeat):
+    data = body.encode('utf-8')
+    seconds = min(timeit.repeat(lambda: json.loads(body), number=1, repeat=repeat))
+    print(f'{name:<28} {len(data):>10,} B {len(gzip.compress(data)):>10,} B gz {seconds * 1000:>8.2f} ms parse')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='a copy of the original currentlyAiring.json')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with open(args.path, 'r') as f:
+        schedule, details = splitLegacyCurrentlyAiring(json.load(f))
+
+    entries = sum(len(dayAnimes) for dayAnimes in schedule.values())
+    print(f'{entries} schedule entries for {len(details)} distinct anime')
+    measure('currentlyAiring.json', buildLegacyCurrentlyAiring(schedule, details), args.repeat)
+    measure('currentlyAiring.v2.json', buildCurrentlyAiring(schedule, details), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
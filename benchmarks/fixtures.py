@@ -0,0 +1,69 @@
+# Realistic stand-ins for the data the lambdas handle, shared by the benchmarks
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'layers', 'animeCache', 'python'))
+
+WORDS = (
+    'the a of and to in is that it was for on are with as his they be at one have this from or had by '
+    'hot word but what some we can out other were all there when up use your how said an each she which '
+    'do their time if will way about many then them write would like so these her long make thing see him '
+    'two has look more day could go come did number sound no most people my over know water than call first'
+).split()
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def paragraph(rng, sentences):
+    return ' '.join(sentence(rng, rng.randint(8, 20)) for _ in range(sentences))
+
+
+def make_anime_details(mal_id, seed=None):
+    # Shaped like what AnimeCache.put_anime_details stores for a mal.Anime
+    rng = random.Random(seed if seed != None else mal_id)
+    title = sentence(rng, rng.randint(2, 5)).rstrip('.')
+    now = datetime.now()
+    return {
+        'mal_id': mal_id,
+        'title': title,
+        'title_english': title.upper(),
+        'title_japanese': '進撃の巨人',
+        'title_synonyms': [sentence(rng, 3).rstrip('.') for _ in range(rng.randint(0, 3))],
+        'url': f'https://myanimelist.net/anime/{mal_id}/{title.replace(" ", "_")}',
+        'image_url': f'https://cdn.myanimelist.net/images/anime/{rng.randint(1, 2000)}/{mal_id}.jpg',
+        'type': rng.choice(['TV', 'Movie', 'OVA', 'ONA']),
+        'status': rng.choice(['Finished Airing', 'Currently Airing']),
+        'genres': rng.sample(['Action', 'Drama', 'Fantasy', 'Comedy', 'Romance', 'Sci-Fi', 'Mystery'], 3),
+        'themes': rng.sample(['Gore', 'Military', 'Survival', 'School', 'Mecha'], 2),
+        'external_links': {name: f'https://example.com/{name}/{mal_id}' for name in ['Official Site', 'Wikipedia', 'Twitter']},
+        'score': round(rng.uniform(5, 9.5), 2),
+        'scored_by': rng.randint(1000, 2000000),
+        'rank': rng.randint(1, 20000),
+        'popularity': rng.randint(1, 20000),
+        'members': rng.randint(1000, 3000000),
+        'favorites': rng.randint(10, 200000),
+        'episodes': rng.randint(1, 64),
+        'aired': 'Apr 7, 2013 to Sep 29, 2013',
+        'premiered': 'Spring 2013',
+        'broadcast': 'Sundays at 01:58 (JST)',
+        'producers': rng.sample(['Production I.G', 'Dentsu', 'Mainichi', 'Pony Canyon', 'Kodansha'], 3),
+        'licensors': ['Funimation'],
+        'studios': ['Wit Studio'],
+        'source': 'Manga',
+        'duration': '24 min. per ep.',
+        'rating': 'R - 17+ (violence & profanity)',
+        'related_anime': {
+            relation: [sentence(rng, 4).rstrip('.') for _ in range(rng.randint(1, 4))]
+            for relation in ['Adaptation', 'Sequel', 'Side story']
+        },
+        'opening_themes': [sentence(rng, 6) for _ in range(rng.randint(1, 3))],
+        'ending_themes': [sentence(rng, 6) for _ in range(rng.randint(1, 3))],
+        'synopsis': paragraph(rng, rng.randint(6, 12)),
+        'background': paragraph(rng, rng.randint(0, 5)),
+        'ttl': int((now + timedelta(weeks=1)).timestamp()),
+        'soft_expiry': int((now + timedelta(days=1)).timestamp()),
+    }
@@ -0,0 +1,83 @@
+# Measures parse time and peak memory of the currently airing forum page.
+#
+#   python benchmarks/forum_parse.py [forum.html]
+#
+# Without a path it parses forum_sample.html, an anonymized stand-in for the
+# page: placeholder ids and titles in the layout forum_parser expects, among
+# forum markup and replies. For numbers on the real page save a copy first:
+#
+#   curl -o forum.html 'https://myanimelist.net/forum/?topicid=1692966'
+#
+# "baseline" is the original html.parser + one soup.find per day, the other
+# rows run forum_parser.parseForumPage with each available parser.
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'dubInfoDownloader'))
+
+from bs4 import BeautifulSoup
+
+import forum_parser
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'forum_sample.html')
+
+
+def baseline(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    return {day: forum_parser.parseWeekList(soup.find(string=day), day) for day in forum_parser.days}
+
+
+def measure(name, parse, html, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        animes = parse(html)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    entries = sum(len(dayAnimes) for dayAnimes in animes.values())
+    print(f'{name:<12} {min(timings) * 1000:>9.1f} ms {peak / 1024 / 1024:>8.1f} MiB peak {entries:>5} entries')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default=SAMPLE, help='a saved copy of the forum page')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.path, 'r', encoding='utf-8') as f:
+        html = f.read()
+
+    cases = [
+        ('baseline', baseline),
+        ('html.parser', lambda html: forum_parser.parseForumPage(html, 'html.parser')),
+    ]
+    if forum_parser.lxml != None:
+        cases.append(('lxml', lambda html: forum_parser.parseForumPage(html, 'lxml')))
+
+    for name, parse in cases:
+        measure(name, quiet(parse), html, args.repeat)
+
+
+def quiet(parse):
+    # Silence the per-day progress prints of parseWeekList
+    def run(html):
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            return parse(html)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return run
+
+
+if __name__ == '__main__':
+    main()
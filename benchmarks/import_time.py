@@ -0,0 +1,67 @@
+# Reports how long each lambda takes to import, which is most of its cold start
+# init duration, along with the slowest modules it pulls in.
+#
+#   python benchmarks/import_time.py [--top 10] [--repeat 3] [lambda ...]
+#
+# Every import runs in a fresh interpreter with `python -X importtime` and the
+# animeCache layer on the path, the fastest run of each lambda is reported.
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAYER = os.path.join(ROOT, 'layers', 'animeCache', 'python')
+LAMBDAS = ['animeDetails', 'animeSearch', 'animeCaching', 'dubInfoDownloader']
+
+
+def import_times(name):
+    # Returns the cumulative import time in microseconds of lambda_function and
+    # of every module it imports directly, as printed by -X importtime
+    directory = os.path.join(ROOT, 'lambdas', name)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [directory, LAYER, env.get('PYTHONPATH')]))
+    # Importing must not need AWS credentials or a region
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import lambda_function'],
+        cwd=directory, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {name} failed:\n{result.stderr}')
+
+    # Children are printed, one level deeper, before the module importing them
+    modules = {}
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        if depth == 1:
+            children[module.strip()] = int(cumulative)
+        elif depth == 0:
+            if module.strip() == 'lambda_function':
+                modules = dict(children, lambda_function=int(cumulative))
+            children = {}
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('lambdas', nargs='*', default=LAMBDAS)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for name in args.lambdas:
+        runs = [import_times(name) for _ in range(args.repeat)]
+        modules = min(runs, key=lambda run: run.get('lambda_function', 0))
+        total = modules.pop('lambda_function', 0)
+        print(f'{name}: {total / 1000:.1f} ms')
+        for module, cumulative in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+            print(f'  {cumulative / 1000:>8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
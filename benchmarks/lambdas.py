@@ -0,0 +1,199 @@
+# Drives the five lambda handlers offline and reports throughput, latency
+# percentiles and dependency call counts for cold and warm caches.
+#
+#   python benchmarks/lambdas.py [--requests 20] [--mal-latency 0.2] [--dynamodb-latency 0.005]
+#                                [--mal-rate 4] [--warming 50]
+#
+# MAL, S3 and SNS are replaced by the fakes in stubs.py, DynamoDB by an
+# in-memory table with a simulated round trip. "cold" requests only touch ids
+# and queries nobody has asked for yet, "warm" requests repeat ones that were
+# asked for during a warm up run.
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+
+import stubs
+
+LAMBDAS = os.path.join(os.path.dirname(__file__), '..', 'lambdas')
+DEPENDENCIES = ['DynamoDB', 'MAL', 'S3', 'SNS']
+TOPIC_ARN = 'arn:aws:sns:us-east-1:000000000000:CacheAnimeTopic'
+BUCKET = 'www.animedubstatus.com'
+
+
+def load_handler(name):
+    # Every lambda is a lambda_function.py so load them under their own names
+    directory = os.path.join(LAMBDAS, name)
+    sys.path.insert(0, directory)
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(f'{name}_lambda_function', os.path.join(directory, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    print(f'{name:<18} imported in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    table = stubs.SimulatedTable(module.cache.backend)
+    module.cache.backend = module.cache.writes.backend = table
+    if hasattr(module, 'backend'):
+        module.backend = table
+    return module
+
+
+def forum_page(mal_ids):
+    # Just enough of the MAL forum post for forum_parser
+    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    html = ['<html><body><div class="message">']
+    for day, start in zip(days, range(0, len(mal_ids), len(mal_ids) // len(days))):
+        html.append(f'<div>{day}<ul>')
+        for mal_id in mal_ids[start:start + len(mal_ids) // len(days)]:
+            html.append(f'<li><a href="https://myanimelist.net/anime/{mal_id}/Name_{mal_id}">Name {mal_id}</a> (Sub: 3/12, Dub: 1/12)</li>')
+        html.append('</ul></div>')
+    html.append('</div></body></html>')
+    return ''.join(html).encode()
+
+
+def sns_event(mal_ids):
+    return {'Records': [{'Sns': {'Message': json.dumps({'mal_ids': mal_ids})}}]}
+
+
+def api_event(params):
+    return {'httpMethod': 'GET', 'queryStringParameters': params}
+
+
+def percentile(timings, p):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def run(name, handler, events, documents):
+    documents.clear()
+    timings = []
+    start = time.perf_counter()
+    for event in events:
+        began = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = handler(event, None)
+        timings.append(time.perf_counter() - began)
+        if isinstance(response, dict) and str(response.get('statusCode', '200')) != '200':
+            raise RuntimeError(f'{name} failed: {response}')
+    elapsed = time.perf_counter() - start
+
+    calls = {
+        dependency: sum(document.get(f'{dependency}Calls', 0) for document in documents) / len(events)
+        for dependency in DEPENDENCIES
+    }
+    hits = sum(document.get('CacheHits', 0) for document in documents)
+    lookups = hits + sum(document.get('CacheMisses', 0) for document in documents)
+    print(
+        f'{name:<24} {len(events) / elapsed:>7.1f} req/s'
+        f' p50 {percentile(timings, 50) * 1000:>7.1f} ms p99 {percentile(timings, 99) * 1000:>7.1f} ms'
+        + (f' hits {hits / lookups * 100:>5.1f}%  ' if lookups > 0 else ' hits     -   ')
+        + ' '.join(f'{dependency} {count:.1f}' for dependency, count in calls.items())
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20, help='requests per scenario')
+    parser.add_argument('--ids', type=int, default=10, help='mal_ids per animeDetails/animeCaching request')
+    parser.add_argument('--airing', type=int, default=70, help='shows on the currently airing page')
+    parser.add_argument('--warming', type=int, default=50, help='dubbed titles for animeWarming to keep warm')
+    parser.add_argument('--mal-latency', type=float, default=0.2)
+    parser.add_argument('--dynamodb-latency', type=float, default=0.005)
+    parser.add_argument('--s3-latency', type=float, default=0.02)
+    parser.add_argument('--sns-latency', type=float, default=0.01)
+    parser.add_argument('--mal-rate', help='MAL_RATE_LIMIT for the lambdas, 0 times them without pacing')
+    args = parser.parse_args()
+
+    if args.mal_rate != None:
+        os.environ['MAL_RATE_LIMIT'] = args.mal_rate
+
+    stubs.configure(mal=args.mal_latency, dynamodb=args.dynamodb_latency, s3=args.s3_latency, sns=args.sns_latency)
+    stubs.install()
+
+    airing = list(range(900000, 900000 + args.airing))
+    server = stubs.StaticServer({
+        '/dubInfo.json': json.dumps({'dubbed': list(range(1, 5000)), 'incomplete': list(range(5000, 5200))}).encode(),
+        '/forum': forum_page(airing),
+    })
+    os.environ.update({
+        'ANIME_CACHE_BACKEND': 'memory',
+        'CacheAnimeTopic': TOPIC_ARN,
+        'DUB_INFO_URL': server.url('/dubInfo.json'),
+        'WARMING_BUCKET': BUCKET,
+        'WARMING_DUB_INFO_KEY': 'warmingDubInfo.json',
+        'WARMING_BUDGET': str(args.warming),
+    })
+    # animeWarming gets a dubInfo.json of its own so dubInfoDownloader doesn't
+    # overwrite it, and ids of its own so the other scenarios don't warm them
+    warming_ids = list(range(800000, 800000 + args.warming))
+    warming_dub_info = json.dumps({'dubbed': warming_ids}).encode()
+
+    details = load_handler('animeDetails')
+    search = load_handler('animeSearch')
+    caching = load_handler('animeCaching')
+    downloader = load_handler('dubInfoDownloader')
+    downloader.currentlyAiringUrl = server.url('/forum')
+    warming = load_handler('animeWarming')
+    print()
+
+    # Every handler emits one metrics document per request, collect them
+    # instead of printing them
+    from anime_cache import metrics
+    documents = []
+    metrics.sink = lambda document: documents.append(json.loads(document))
+
+    n = args.requests
+    ids = args.ids
+    fresh = iter(range(1, 10 ** 6))
+
+    def fresh_ids():
+        return [next(fresh) for _ in range(ids)]
+
+    warm_ids = [fresh_ids() for _ in range(5)]
+    details_events = [api_event({'mal_ids': ','.join(map(str, warm_ids[i % 5]))}) for i in range(n)]
+    run('animeDetails warm up', details.lambda_handler, details_events[:5], documents)
+    run('animeDetails cold', details.lambda_handler, [api_event({'mal_ids': ','.join(map(str, fresh_ids()))}) for _ in range(n)], documents)
+    run('animeDetails warm', details.lambda_handler, details_events, documents)
+
+    search_events = [api_event({'query': f'warm query {i % 5}'}) for i in range(n)]
+    run('animeSearch warm up', search.lambda_handler, search_events[:5], documents)
+    run('animeSearch cold', search.lambda_handler, [api_event({'query': f'cold query {i}'}) for i in range(n)], documents)
+    run('animeSearch warm', search.lambda_handler, search_events, documents)
+
+    caching_events = [sns_event(warm_ids[i % 5]) for i in range(n)]
+    run('animeCaching warm up', caching.lambda_handler, caching_events[:5], documents)
+    run('animeCaching cold', caching.lambda_handler, [sns_event(fresh_ids()) for _ in range(n)], documents)
+    run('animeCaching warm', caching.lambda_handler, caching_events, documents)
+
+    # The downloader runs once a day so every cold run starts from an empty
+    # bucket and table, and the warm runs see the same upstream content again
+    def cold_downloader(event, context):
+        stubs.s3.objects.clear()
+        downloader.cache.backend.backend.items.clear()
+        return downloader.lambda_handler(event, context)
+
+    downloader_runs = max(1, n // 4)
+    run('dubInfoDownloader cold', cold_downloader, [{}] * downloader_runs, documents)
+    run('dubInfoDownloader warm', downloader.lambda_handler, [{}] * downloader_runs, documents)
+
+    # A cold run caches every title within its budget, a warm run finds them
+    # all fresh and only reads their freshness attributes
+    def cold_warming(event, context):
+        warming.cache.backend.backend.items.clear()
+        stubs.s3.objects[(BUCKET, 'warmingDubInfo.json')] = (warming_dub_info, {})
+        return warming.lambda_handler(event, context)
+
+    run('animeWarming cold', cold_warming, [{}] * downloader_runs, documents)
+    run('animeWarming warm', warming.lambda_handler, [{}] * downloader_runs, documents)
+
+    print(f'\nSNS messages published: {len(stubs.sns.messages)}, upstream HTTP requests: {server.requests}')
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
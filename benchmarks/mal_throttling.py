@@ -0,0 +1,125 @@
+# Runs cache fills against a fake MAL that answers 429 past a request rate, or
+# 503 while it is down, to show what the MalThrottle rate limiter and circuit
+# breaker do about it.
+#
+#   python benchmarks/mal_throttling.py [--ids 40] [--mal-limit 10] [--rate 20]
+#
+# unpaced    every id is fetched at once, as before the throttle existed
+# paced      the bucket is set to what MAL allows, without bursts
+# adaptive   the bucket starts at --rate, above what MAL allows, and backs off
+# shared     two callers, e.g. animeCaching and dubInfoDownloader, share one bucket
+# outage     MAL is down, the circuit opens and stale items keep being served
+import argparse
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stubs
+
+# The throttle under test is passed in explicitly, keep the default one out of it
+os.environ['MAL_RATE_LIMIT'] = '0'
+os.environ['MAL_FETCH_CONCURRENCY'] = '8'
+stubs.configure(mal=0.05)
+stubs.install()
+
+from anime_cache import AnimeCache, MalThrottle, MemoryBackend, fetch_animes, metrics
+from anime_cache.throttle import LocalThrottleState
+from fixtures import make_anime_details
+
+
+def throttled_loader(throttle):
+    if throttle == None:
+        return stubs.FakeAnime
+    return lambda mal_id, timeout: throttle.call(stubs.FakeAnime, mal_id, timeout=timeout)
+
+
+def report(name, start, fetched, errors):
+    throttled = sum(1 for error in errors.values() if getattr(error, 'status_code', None) == 429)
+    print(
+        f'{name:<10} {time.time() - start:>6.2f} s  fetched {fetched:>3}  failed {len(errors):>3}'
+        f'  MAL requests {stubs.mal_server["requests"]:>3}  429s {stubs.mal_server["throttled"]:>3}'
+        f' (surfaced {throttled:>3})  circuit rejections {metrics.count("MALCircuitOpen"):>3}'
+    )
+
+
+def run(name, ids, throttle):
+    stubs.configure_mal(requests=0, throttled=0, failed=0)
+    stubs.mal_requests.clear()
+    metrics.reset(name)
+    errors = {}
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fetched = fetch_animes(ids, throttled_loader(throttle), errors=errors)
+    report(name, start, len(fetched), errors)
+    return throttle
+
+
+def run_shared(name, ids, state, rate, burst):
+    # Both halves of the ids are fetched at the same time by separate throttles
+    # over one state, as two lambdas sharing MAL_RATE_LIMIT_TABLE would
+    stubs.configure_mal(requests=0, throttled=0, failed=0)
+    stubs.mal_requests.clear()
+    metrics.reset(name)
+    halves = [ids[::2], ids[1::2]]
+    errors = {}
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(
+            lambda half: fetch_animes(half, throttled_loader(MalThrottle(state, rate=rate, burst=burst)), errors=errors),
+            halves
+        ))
+    report(name, start, sum(len(result) for result in results), errors)
+
+
+def run_outage(name, ids, threshold):
+    # Every cached item is stale, so each request tries to refresh it from MAL
+    stubs.configure_mal(requests=0, throttled=0, failed=0, down=True)
+    metrics.reset(name)
+    items = []
+    for mal_id in ids:
+        item = make_anime_details(mal_id)
+        item['soft_expiry'] = int(time.time()) - 60
+        items.append(item)
+    throttle = MalThrottle(rate=100, burst=100, threshold=threshold, open_seconds=30)
+    cache = AnimeCache(MemoryBackend(items), loader=throttled_loader(throttle))
+
+    start = time.time()
+    served = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for mal_id in ids:
+            served += len(cache.get_or_put_animes([mal_id]))
+    print(
+        f'{name:<10} {time.time() - start:>6.2f} s  served {served:>3} of {len(ids)}'
+        f'  MAL requests {stubs.mal_server["requests"]:>3}  stale served {metrics.count("StaleServed"):>3}'
+        f'  circuit rejections {metrics.count("MALCircuitOpen"):>3}'
+    )
+    stubs.configure_mal(down=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ids', type=int, default=40)
+    parser.add_argument('--mal-limit', type=int, default=10, help='requests per second the fake MAL allows')
+    parser.add_argument('--rate', type=float, default=20, help='starting rate of the adaptive run')
+    parser.add_argument('--threshold', type=int, default=5, help='failures in a row that open the circuit')
+    args = parser.parse_args()
+
+    stubs.configure_mal(limit=args.mal_limit)
+    ids = list(range(1, args.ids + 1))
+
+    run('unpaced', ids, None)
+    time.sleep(1)
+    run('paced', ids, MalThrottle(rate=args.mal_limit, burst=1))
+    time.sleep(1)
+    adaptive = run('adaptive', ids, MalThrottle(rate=args.rate, burst=args.rate, threshold=args.ids))
+    print(f'{"":<10} rate backed off to {adaptive.state.state.get("rate", args.rate):.2f}/s')
+    time.sleep(1)
+    run_shared('shared', ids, LocalThrottleState(), args.mal_limit, 1)
+    time.sleep(1)
+    run_outage('outage', ids, args.threshold)
+
+
+if __name__ == '__main__':
+    main()
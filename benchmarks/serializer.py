@@ -0,0 +1,57 @@
+# Compares the original read path, convert_decimals_to_floats followed by
+# json.dumps, with serializing the items straight from DynamoDB in one pass.
+#
+#   python benchmarks/serializer.py [--items 20]
+import argparse
+import json
+import time
+import tracemalloc
+from decimal import Decimal
+
+from fixtures import make_anime_details
+
+from anime_cache import convert, convert_floats_to_decimals, dumps
+
+
+def recursive_decimals_to_floats(data):
+    if isinstance(data, dict):
+        return {k: recursive_decimals_to_floats(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [recursive_decimals_to_floats(item) for item in data]
+    elif isinstance(data, Decimal):
+        return float(data)
+    else:
+        return data
+
+
+def measure(name, run, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        run()
+        timings.append(time.process_time() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:<20} {min(timings) * 1000:>8.2f} ms cpu {peak / 1024:>9.1f} KiB allocated at peak')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=20, help='items per request, e.g. one animeDetails page')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    details = {mal_id: make_anime_details(mal_id) for mal_id in range(1, args.items + 1)}
+    items = {mal_id: convert_floats_to_decimals(anime) for mal_id, anime in details.items()}
+
+    print(f'{args.items} items per request, orjson {"enabled" if convert.orjson != None else "not installed"}')
+    measure('recursive + json', lambda: json.dumps({k: recursive_decimals_to_floats(v) for k, v in items.items()}), args.repeat)
+    measure('single pass', lambda: dumps(items), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# Local stand-ins for MAL, S3, SNS and DynamoDB so the lambdas can be driven
+# offline. install() has to run before any lambda or anime_cache is imported.
+import hashlib
+import io
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fixtures import make_anime_details
+
+# Simulated round trip times in seconds, changed through configure()
+latency = {'mal': 0.2, 'dynamodb': 0.005, 's3': 0.02, 'sns': 0.01}
+
+# How the fake MAL misbehaves: `limit` requests per second are allowed before
+# it answers 429, and while `down` every request fails with a 503
+mal_server = {'limit': None, 'down': False, 'requests': 0, 'throttled': 0, 'failed': 0}
+mal_requests = []
+mal_lock = threading.Lock()
+
+
+def configure(**latencies):
+    latency.update(latencies)
+
+
+def configure_mal(**settings):
+    mal_server.update(settings)
+
+
+class HTTPError(Exception):
+    # Carries the status like requests.HTTPError does through its response
+
+    def __init__(self, status_code):
+        super().__init__(f'{status_code} response from MAL')
+        self.status_code = status_code
+
+
+def request_mal():
+    with mal_lock:
+        mal_server['requests'] += 1
+        now = time.time()
+        while len(mal_requests) > 0 and mal_requests[0] <= now - 1:
+            mal_requests.pop(0)
+        if mal_server['down']:
+            mal_server['failed'] += 1
+            raise HTTPError(503)
+        if mal_server['limit'] != None and len(mal_requests) >= mal_server['limit']:
+            mal_server['throttled'] += 1
+            raise HTTPError(429)
+        mal_requests.append(now)
+    time.sleep(latency['mal'])
+
+
+class FakeAnime:
+    # Mirrors the attributes of mal.Anime that build_anime_details reads
+
+    def __init__(self, mal_id, timeout=5):
+        request_mal()
+        details = make_anime_details(int(mal_id))
+        for field, value in details.items():
+            setattr(self, field, value)
+
+
+class FakeSearchResult:
+
+    def __init__(self, mal_id):
+        details = make_anime_details(mal_id)
+        self.mal_id = mal_id
+        self.title = details['title']
+        self.url = details['url']
+        self.image_url = details['image_url']
+        self.type = details['type']
+        self.score = details['score']
+        self.synopsis = details['synopsis'][:200]
+
+
+class FakeAnimeSearch:
+    # Every query deterministically maps to its own page of results
+
+    def __init__(self, query, timeout=5):
+        request_mal()
+        seed = int(hashlib.sha256(query.lower().encode()).hexdigest()[:6], 16)
+        self.results = [FakeSearchResult(100000 + seed % 50000 + i) for i in range(50)]
+
+
+class ClientError(Exception):
+
+    def __init__(self, error_response, operation_name):
+        super().__init__(f'An error occurred ({error_response["Error"]["Code"]}) when calling the {operation_name} operation')
+        self.response = error_response
+        self.operation_name = operation_name
+
+
+class FakeS3:
+
+    def __init__(self):
+        self.objects = {}
+
+    def head_object(self, Bucket, Key):
+        time.sleep(latency['s3'])
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        body, extra = self.objects[(Bucket, Key)]
+        return {'ContentLength': len(body), 'Metadata': extra.get('Metadata', {})}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        time.sleep(latency['s3'])
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        body, extra = self.objects[(Bucket, Key)]
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body), 'ETag': etag, 'Metadata': extra.get('Metadata', {})}
+
+    def put_object(self, Bucket, Key, Body, **extra):
+        time.sleep(latency['s3'])
+        self.objects[(Bucket, Key)] = (Body if isinstance(Body, bytes) else Body.encode(), extra)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        time.sleep(latency['s3'])
+        self.objects[(Bucket, Key)] = (Fileobj.read(), ExtraArgs or {})
+
+
+class FakeSNS:
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, TopicArn, Message, **kwargs):
+        time.sleep(latency['sns'])
+        self.messages.append((TopicArn, Message))
+        return {'MessageId': str(len(self.messages))}
+
+
+class SimulatedTable:
+    # Wraps a MemoryBackend so its calls cost, and are counted, like DynamoDB's
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        # Imported late, anime_cache must not load before install()
+        from anime_cache import metrics
+        method = getattr(self.backend, name)
+
+        def call(*args, **kwargs):
+            with metrics.timer('DynamoDB'):
+                time.sleep(latency['dynamodb'])
+                return method(*args, **kwargs)
+        return call
+
+    def scan(self, attributes=None):
+        from anime_cache import metrics
+        with metrics.timer('DynamoDB'):
+            time.sleep(latency['dynamodb'])
+            items = list(self.backend.scan(attributes))
+        return iter(items)
+
+
+s3 = FakeS3()
+sns = FakeSNS()
+
+
+def client(service_name, *args, **kwargs):
+    return {'s3': s3, 'sns': sns}[service_name]
+
+
+def resource(service_name, *args, **kwargs):
+    raise RuntimeError('The benchmarks run with ANIME_CACHE_BACKEND=memory')
+
+
+def install():
+    # Routes `mal` to the fakes above, and boto3 to the fake clients whether or
+    # not boto3 itself is installed
+    mal = types.ModuleType('mal')
+    mal.Anime = FakeAnime
+    mal.AnimeSearch = FakeAnimeSearch
+    sys.modules['mal'] = mal
+
+    try:
+        import boto3
+        import botocore.exceptions
+        global ClientError
+        ClientError = botocore.exceptions.ClientError
+    except ImportError:
+        boto3 = types.ModuleType('boto3')
+        botocore = types.ModuleType('botocore')
+        botocore.exceptions = types.ModuleType('botocore.exceptions')
+        botocore.exceptions.ClientError = ClientError
+        sys.modules.update({'boto3': boto3, 'botocore': botocore, 'botocore.exceptions': botocore.exceptions})
+    boto3.client = client
+    boto3.resource = resource
+
+
+class StaticServer:
+    # Serves fixed documents over HTTP with ETag support, standing in for
+    # GitHub (dubInfo.json) and the MAL forum page
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                server.requests += 1
+                body = server.documents.get(self.path)
+                if body == None:
+                    self.send_error(404)
+                    return
+                etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def close(self):
+        self.httpd.shutdown()
@@ -1,156 +1,110 @@
-import boto3
 import logging
-from mal import Anime, AnimeSearch
 import json
-from datetime import datetime, timedelta
-import sys
-from decimal import Decimal
+import os
+from anime_cache import AnimeCache, MalUnavailable, create_backend, dumps, metrics, publish_mal_ids, run_in_chunks
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 logger.info('Loading function')
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('anime-cache')
+cache = AnimeCache(create_backend())
+
+# Ids are cached a chunk at a time. Before every chunk the remaining time is
+# checked and whatever won't fit is published back to CacheAnimeTopic.
+cachingChunkSize = int(os.environ.get('CACHING_CHUNK_SIZE', '16'))
+# Time kept back for flushing the cache and re-publishing
+cachingReserveMillis = int(os.environ.get('CACHING_RESERVE_MILLIS', '5000'))
+# Ids that have been put back this many times are dropped instead
+cachingMaxAttempts = int(os.environ.get('CACHING_MAX_ATTEMPTS', '3'))
 
 def respond(err, res=None):
     return {
         'statusCode': '400' if err else '200',
-        'body': str(err) if err else json.dumps(res),
+        'body': str(err) if err else dumps(res),
         'headers': {
             'Content-Type': 'application/json'
         },
     }
 
 def lambda_handler(event, context):
+    with metrics.request('animeCaching'):
+        return handle(event, context)
+
+def handle(event, context):
     if 'Records' in event:
         # SNS Trigger
+        mal_ids = []
+        attempt = 0
         for record in event['Records']:
             sns_message = json.loads(record['Sns']['Message'])
             
             if 'mal_ids' in sns_message:
-                mal_ids = sns_message['mal_ids']
-                # Process SNS message
-                print(f'Attempting to cache the following anime ids {mal_ids}')
-                
-                for mal_id in mal_ids:
-                    get_or_put_anime(mal_id)
-                
-        return respond(None, f'Cached {len(mal_ids)} animes')
-    else:
-        return respond(ValueError('Not support operation'))
-
-def get_or_put_anime(mal_id):
-    # Check if the item already exists in the "anime-cache" table
-    response = table.get_item(
-        Key={
-            'mal_id': mal_id
-        }
-    )
-    
-    # If the item exists
-    if 'Item' in response:
-        existing_item = convert_decimals_to_floats(response['Item'])
-        print(f'Found anime with id {mal_id} in cache')
-        return existing_item
-    else:
-        # Calculate the expiration time (1 week from the current time)
-        expiration_time = datetime.now() + timedelta(weeks=1)
-        expiration_timestamp = int(expiration_time.timestamp())
-        
-        anime = Anime(mal_id)
+                mal_ids.extend(sns_message['mal_ids'])
+            attempt = max(attempt, int(sns_message.get('attempt', 0)))
+        mal_ids = list(dict.fromkeys(mal_ids))
+        print(f'Attempting to cache the following anime ids {mal_ids}')
         
-        anime_details = {
-                'mal_id': anime.mal_id,
-                'title': anime.title,
-                'title_english': anime.title_english,
-                'title_japanese': anime.title_japanese,
-                'title_synonyms': anime.title_synonyms,
-                'url': anime.url,
-                'image_url': anime.image_url,
-                'type': anime.type,
-                'status': anime.status,
-                'genres': anime.genres,
-                'themes': anime.themes,
-                'external_links': anime.external_links,
-                'score': anime.score,
-                'scored_by': anime.scored_by,
-                'rank': anime.rank,
-                'popularity': anime.popularity,
-                'members': anime.members,
-                'favorites': anime.favorites,
-                'episodes': anime.episodes,
-                'aired': anime.aired,
-                'premiered': anime.premiered,
-                'broadcast': anime.broadcast,
-                'producers': anime.producers,
-                'licensors': anime.licensors,
-                'studios': anime.studios,
-                'source': anime.source,
-                'duration': anime.duration,
-                'rating': anime.rating,
-                'related_anime': anime.related_anime,
-                'opening_themes': anime.opening_themes,
-                'ending_themes': anime.ending_themes,
-                'synopsis':  anime.synopsis,
-                'background': anime.background,
-                'ttl': expiration_timestamp
-            }
+        cached = []
+        errors = {}
+        unavailable = []
         
+        def cache_chunk(chunk):
+            # A failing id is recorded in `errors`, the rest of the chunk still gets cached
+            cached.extend(cache.get_or_put_animes(chunk, errors=errors))
+            unavailable.extend(take_unavailable(errors))
+            # MAL is off limits for now, leave the remaining chunks alone too
+            return len(unavailable) > 0
         
-        item = convert_floats_to_decimals(anime_details)
+        try:
+            left = run_in_chunks(mal_ids, cachingChunkSize, cache_chunk, context, cachingReserveMillis)
+        finally:
+            # Write out anything still sitting in the batch write buffer
+            cache.flush()
         
-        # Store the new item in the "animes" table
-        table.put_item(Item=item)
+        deferred = []
+        if len(unavailable) > 0:
+            unavailable.extend(left)
+        else:
+            deferred = left
         
-        size_in_kb = get_dict_size(item)
-        print(f"Storing anime in cache with size: {size_in_kb:.2f} KB")
-        return anime_details
+        metrics.increment('CachingFailures', len(errors))
+        if len(unavailable) > 0:
+            # Re-publishing would have SNS invoke us again right away. Failing
+            # the invocation instead lets Lambda retry the event with backoff,
+            # the ids cached so far are cheap hits by then.
+            metrics.increment('CachingUnavailable', len(unavailable))
+            raise MalUnavailable(f'MAL is unavailable, leaving {unavailable} to the retry')
         
-def get_dict_size(dictionary):
-    size_bytes = sys.getsizeof(dictionary)
-    size_kb = size_bytes / 1024
-    return size_kb
-    
-def convert_decimals_to_floats(data):
-    if isinstance(data, dict):
-        return {k: convert_decimals_to_floats(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_decimals_to_floats(item) for item in data]
-    elif isinstance(data, Decimal):
-        return float(data)
-    else:
-        return data
+        dropped = []
+        if len(deferred) > 0:
+            if attempt + 1 > cachingMaxAttempts:
+                print(f'Giving up on {deferred} after {attempt} attempts')
+                dropped, deferred = deferred, []
+            else:
+                requeue(deferred, attempt + 1)
+        metrics.increment('CachingDeferred', len(deferred))
+        metrics.increment('CachingDropped', len(dropped))
         
-def convert_floats_to_decimals(data):
-    if isinstance(data, dict):
-        return {k: convert_floats_to_decimals(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_floats_to_decimals(item) for item in data]
-    elif isinstance(data, float):
-        return Decimal(str(data))
+        return respond(None, {
+            'cached': cached,
+            'failed': {str(mal_id): repr(error) for mal_id, error in errors.items()},
+            'deferred': deferred,
+            'dropped': dropped
+        })
     else:
-        return data
-        
-def get_ids_from_string(string):
-    # Remove leading/trailing spaces from the string
-    string = string.strip()
-
-    # Check if the string is empty
-    if len(string) == 0:
-        return None
-
-    # Split the string by commas
-    numbers = string.split(',')
+        return respond(ValueError('Not support operation'))
 
-    ids = []
-    # Check if each element is an integer
-    for num in numbers:
-        num = num.strip()
-        if not num.isdigit():
-            return None
-        else:
-            ids.append(int(num))
+def take_unavailable(errors):
+    # Ids that never reached MAL aren't failures, they get another go later
+    unavailable = [mal_id for mal_id, error in errors.items() if isinstance(error, MalUnavailable)]
+    for mal_id in unavailable:
+        del errors[mal_id]
+    return unavailable
 
-    return ids
\ No newline at end of file
+def requeue(mal_ids, attempt):
+    if os.environ.get('CacheAnimeTopic') == None:
+        print(f'Ran out of time, no CacheAnimeTopic to re-publish {mal_ids} to')
+        return
+    print(f'Ran out of time, re-publishing {mal_ids} (attempt {attempt})')
+    publish_mal_ids(mal_ids, attempt=attempt)
@@ -1,25 +1,35 @@
-import boto3
 import logging
-from mal import Anime, AnimeSearch
-import json
-from datetime import datetime, timedelta
-import sys
-from decimal import Decimal
+import time
 import os
+from anime_cache import AnimeCache, MalUnavailable, call_mal, create_backend, create_search_cache, dumps, load_prefix_index, metrics, normalize_query, publish_mal_ids
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 logger.info('Loading function')
 
-sns_client = boto3.client('sns')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('anime-cache')
+backend = create_backend()
+cache = AnimeCache(backend)
+
+# Results of live MAL searches are cached per normalized query
+searchCache = create_search_cache()
+
+# Common queries are answered from the titles already in "anime-cache" when the
+# prefix index has enough matches. dubInfoDownloader publishes the index to S3,
+# a newer copy is looked for once the loaded one gets too old.
+searchIndexEnabled = os.environ.get('SEARCH_INDEX_ENABLED', 'true').lower() == 'true'
+searchIndexMaxAge = int(os.environ.get('SEARCH_INDEX_MAX_AGE', '3600'))
+searchIndexMinQueryLength = int(os.environ.get('SEARCH_INDEX_MIN_QUERY_LENGTH', '3'))
+searchIndexMinResults = int(os.environ.get('SEARCH_INDEX_MIN_RESULTS', '5'))
+prefixIndex = None
+prefixIndexCheckedAt = 0
+
+maxResults = 20
 
 def respond(err, res=None):
     return {
         'statusCode': '400' if err else '200',
-        'body': str(err) if err else json.dumps(res),
+        'body': str(err) if err else dumps(res),
         'headers': {
             'Content-Type': 'application/json',
             "Access-Control-Allow-Headers" : "Content-Type",
@@ -29,6 +39,10 @@ def respond(err, res=None):
     }
 
 def lambda_handler(event, context):
+    with metrics.request('animeSearch'):
+        return handle(event, context)
+
+def handle(event, context):
     operation = event['httpMethod']
     if operation == 'GET':
         queryParams = event['queryStringParameters']
@@ -36,14 +50,37 @@ def lambda_handler(event, context):
         if 'query' in queryParams:
             searchString = queryParams['query']
             
-            if searchString == None:
+            query = normalize_query(searchString) if searchString != None else ''
+            # Whitespace only is no search either, and '' can't be a DynamoDB key
+            if query == '':
                 return respond(ValueError('No search string provided'))
             
-            search = AnimeSearch(searchString)
+            searchResults = searchCache.get(query)
+            if searchResults != None:
+                print(f'Found search results for "{query}" in cache')
+                return respond(None, searchResults)
+            
+            searchResults = search_prefix_index(query)
+            if searchResults != None:
+                print(f'Answered "{query}" from the prefix index')
+                searchCache.put(query, searchResults)
+                return respond(None, searchResults)
+            
+            # mal (requests, bs4) is only imported once a query actually needs MAL
+            from mal import AnimeSearch
+            try:
+                search = call_mal(AnimeSearch, searchString)
+            except MalUnavailable as e:
+                # MAL is being throttled or failing, any match we have beats an error
+                searchResults = search_prefix_index(query, 1)
+                if searchResults == None:
+                    return respond(e)
+                print(f'MAL unavailable, answered "{query}" from the prefix index')
+                return respond(None, searchResults)
             if search == None or len(search.results) <= 0:
                 return respond(ValueError('Failed to get results. Please adjust your query or try again.'))
             
-            results = move_matching_title_to_front(keep_max(search.results, 20), searchString)
+            results = move_matching_title_to_front(keep_max(search.results, maxResults), searchString)
             
             searchResults = []
             mal_ids = []
@@ -59,13 +96,15 @@ def lambda_handler(event, context):
                 }
                 searchResults.append(anime_details)
                 mal_ids.append(anime.mal_id)
-                
-            sns_client.publish(
-                TopicArn=os.environ['CacheAnimeTopic'],
-                Message=json.dumps({
-                    'mal_ids': mal_ids
-                })
-            )
+            
+            searchCache.put(query, searchResults)
+            
+            # Only ask animeCaching for the results that actually need caching
+            uncached_ids = cache.find_uncached(mal_ids)
+            if len(uncached_ids) > 0:
+                publish_mal_ids(uncached_ids)
+            else:
+                print('All search results are already cached')
                 
             return respond(None, searchResults)
         else:
@@ -74,6 +113,34 @@ def lambda_handler(event, context):
     else:
         return respond(ValueError('Unsupported method "{}"'.format(operation)))
     
+def search_prefix_index(query, minResults=None):
+    if not searchIndexEnabled or len(query) < searchIndexMinQueryLength:
+        return None
+    
+    if time.time() - prefixIndexCheckedAt > searchIndexMaxAge:
+        refresh_prefix_index()
+    if prefixIndex == None:
+        return None
+    
+    results = prefixIndex.search(query, maxResults)
+    if len(results) < (minResults or searchIndexMinResults):
+        return None
+    return results
+    
+def refresh_prefix_index():
+    global prefixIndex, prefixIndexCheckedAt
+    prefixIndexCheckedAt = time.time()
+    try:
+        # Only downloaded again when the published copy has changed
+        loaded = load_prefix_index(prefixIndex.etag if prefixIndex != None else None)
+    except Exception as e:
+        # Searching still works without the index, MAL answers instead
+        print(f'Failed to load the prefix index: {e!r}')
+        return
+    if loaded != None:
+        prefixIndex = loaded
+        print(f'Loaded prefix index over {len(prefixIndex)} cached anime')
+    
 def keep_max(array, max):
     if len(array) > max:
         return array[:max]
@@ -0,0 +1,139 @@
+import logging
+import json
+import os
+import time
+from anime_cache import (
+    FRESHNESS_ATTRIBUTES,
+    AnimeCache,
+    MalUnavailable,
+    create_backend,
+    get_client,
+    is_complete,
+    is_leased,
+    metrics,
+    run_in_chunks,
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+logger.info('Loading function')
+
+cache = AnimeCache(create_backend())
+
+# dubInfo.json as published by dubInfoDownloader
+bucketName = os.environ.get('WARMING_BUCKET', 'www.animedubstatus.com')
+fileName = os.environ.get('WARMING_DUB_INFO_KEY', 'dubInfo.json')
+# The dubInfo.json lists whose titles are worth keeping warm
+warmingStatuses = os.environ.get('WARMING_STATUSES', 'dubbed').split(',')
+
+# Of the cached titles only the most popular are kept warm, and only those
+# whose ttl runs out within the margin get refreshed
+warmingTopN = int(os.environ.get('WARMING_TOP_N', '500'))
+warmingMarginHours = float(os.environ.get('WARMING_MARGIN_HOURS', '48'))
+# At most this many titles are fetched from MAL per run
+warmingBudget = int(os.environ.get('WARMING_BUDGET', '100'))
+# Titles that were never cached have no popularity to rank them by, this share
+# of the budget is kept for them so they get cached eventually
+warmingUncachedShare = float(os.environ.get('WARMING_UNCACHED_SHARE', '0.25'))
+warmingChunkSize = int(os.environ.get('WARMING_CHUNK_SIZE', '16'))
+# Time kept back for flushing the cache
+warmingReserveMillis = int(os.environ.get('WARMING_RESERVE_MILLIS', '5000'))
+
+RANKING_ATTRIBUTES = FRESHNESS_ATTRIBUTES + ['popularity']
+
+def lambda_handler(event, context):
+    with metrics.request('animeWarming'):
+        return handle(event, context)
+
+def handle(event, context):
+    mal_ids = getDubbedIds()
+    cached = cache.backend.batch_get(mal_ids, RANKING_ATTRIBUTES)
+    
+    now = int(time.time())
+    uncached = findUncached(mal_ids, cached, now)
+    ranked = rankByPopularity([mal_id for mal_id in mal_ids if isCached(cached.get(mal_id))], cached)[:warmingTopN]
+    expiring = findExpiring(ranked, cached, now)
+    selected = selectWithinBudget(expiring, uncached)
+    print(f'{len(mal_ids)} dubbed titles, {len(expiring)} of the top {len(ranked)} and {len(uncached)} uncached need warming, refreshing {len(selected)}')
+    
+    refreshed = []
+    errors = {}
+    
+    def warmChunk(chunk):
+        # Expiring items count as stale so they are refreshed under the fill
+        # lease, and only their keys are read back. Stale copies handed back
+        # for leases someone else holds don't land in `refreshed`.
+        cache.get_or_put_animes(chunk, ['mal_id'], errors, refreshed)
+        if any(isinstance(error, MalUnavailable) for error in errors.values()):
+            print('MAL is unavailable, stopping early')
+            return True
+        return False
+    
+    try:
+        left = run_in_chunks(selected, warmingChunkSize, warmChunk, context, warmingReserveMillis)
+        if len(left) > 0:
+            print(f'Stopped with {len(left)} titles left to warm')
+    finally:
+        # Write out anything still sitting in the batch write buffer
+        cache.flush()
+    
+    metrics.increment('WarmingRefreshed', len(refreshed))
+    metrics.increment('WarmingFailures', len(errors))
+    metrics.increment('WarmingBacklog', len(expiring) + len(uncached) - len(refreshed))
+    
+    return {
+        'candidates': len(mal_ids),
+        'expiring': len(expiring),
+        'uncached': len(uncached),
+        'refreshed': refreshed,
+        'failed': {str(mal_id): repr(error) for mal_id, error in errors.items()}
+    }
+
+def getDubbedIds():
+    with metrics.timer('S3'):
+        response = get_client('s3').get_object(Bucket=bucketName, Key=fileName)
+    dubInfo = json.load(response['Body'])
+    
+    mal_ids = []
+    for status in warmingStatuses:
+        mal_ids.extend(int(mal_id) for mal_id in dubInfo.get(status.strip(), []))
+    return list(dict.fromkeys(mal_ids))
+
+def isCached(item):
+    return item != None and is_complete(item)
+
+def findUncached(mal_ids, cached, now):
+    # In dubInfo.json order
+    return [
+        mal_id for mal_id in mal_ids
+        if not isCached(cached.get(mal_id)) and not is_leased(cached.get(mal_id), now)
+    ]
+
+def rankByPopularity(mal_ids, cached):
+    # MAL popularity is a rank, 1 being the most popular
+    def popularity(mal_id):
+        if cached[mal_id].get('popularity') == None:
+            return float('inf')
+        return int(cached[mal_id]['popularity'])
+    return sorted(mal_ids, key=popularity)
+
+def findExpiring(mal_ids, cached, now):
+    refreshBy = now + int(warmingMarginHours * 3600)
+    
+    expiring = []
+    for mal_id in mal_ids:
+        item = cached[mal_id]
+        if is_leased(item, now):
+            continue
+        # Only items past their soft expiry are refreshed by the cache
+        if cache.is_stale(item, now) and int(item.get('ttl', 0)) <= refreshBy:
+            expiring.append(mal_id)
+    return expiring
+
+def selectWithinBudget(expiring, uncached):
+    # Uncached titles get their share of the budget, expiring popular ones the
+    # rest, and whichever needs less leaves its share to the other
+    uncachedBudget = min(len(uncached), int(warmingBudget * warmingUncachedShare))
+    selected = expiring[:warmingBudget - uncachedBudget]
+    return selected + uncached[:warmingBudget - len(selected)]
@@ -0,0 +1,96 @@
+from anime_cache import convert_decimals_to_floats, convert_floats_to_decimals, dumps
+
+# Only the fields the frontend renders for a currently airing show
+currentlyAiringFields = [
+    'mal_id',
+    'title',
+    'title_english',
+    'url',
+    'image_url',
+    'type',
+    'status',
+    'score',
+    'episodes',
+    'broadcast',
+    'genres',
+]
+
+def airingDetails(anime):
+    # Freshly fetched details hold floats and cached ones Decimals, as Decimals
+    # both render the same so an unchanged schedule keeps its sha256
+    return convert_floats_to_decimals({field: anime.get(field) for field in currentlyAiringFields})
+
+def buildCurrentlyAiring(schedule, details):
+    # The schedule only holds ids and episode progress per day, the details of
+    # every show are listed once no matter how many days it airs on
+    return dumps({
+        'schedule': schedule,
+        'details': {str(mal_id): airingDetails(details[mal_id]) for mal_id in scheduleIds(schedule)}
+    }, separators=(',', ':'))
+
+def buildLegacyCurrentlyAiring(schedule, details):
+    # The original format with the full cached details embedded in every entry
+    animes = {}
+    for day, dayAnimes in schedule.items():
+        animes[day] = [dict(anime, details=details[anime['mal_id']]) for anime in dayAnimes]
+    return dumps(animes)
+
+def splitLegacyCurrentlyAiring(animes):
+    # Turns the original format back into a schedule and details table
+    schedule = {}
+    details = {}
+    for day, dayAnimes in animes.items():
+        schedule[day] = []
+        for anime in dayAnimes:
+            entry = dict(anime)
+            details[entry['mal_id']] = entry.pop('details')
+            schedule[day].append(entry)
+    return schedule, details
+
+def diffSchedules(previous, schedule):
+    # Entries are matched by mal_id within a day. Anything else that differs,
+    # usually the episode progress, makes an entry changed.
+    added = {}
+    removed = {}
+    changed = {}
+    for day in list(dict.fromkeys(list(schedule) + list(previous))):
+        before = {anime['mal_id']: anime for anime in previous.get(day, [])}
+        after = {anime['mal_id']: anime for anime in schedule.get(day, [])}
+        
+        dayAdded = [anime for mal_id, anime in after.items() if mal_id not in before]
+        dayRemoved = [mal_id for mal_id in before if mal_id not in after]
+        dayChanged = [anime for mal_id, anime in after.items() if mal_id in before and anime != before[mal_id]]
+        if len(dayAdded) > 0:
+            added[day] = dayAdded
+        if len(dayRemoved) > 0:
+            removed[day] = dayRemoved
+        if len(dayChanged) > 0:
+            changed[day] = dayChanged
+    return added, removed, changed
+
+def scheduleIds(schedule):
+    return list(dict.fromkeys(anime['mal_id'] for dayAnimes in schedule.values() for anime in dayAnimes))
+
+def buildCurrentlyAiringDelta(previous, schedule, details, version):
+    # Turns the previous currentlyAiring.v2.json, identified by its hash as
+    # `base`, into the one with the `version` hash. Only details that are new or
+    # differ are included, and `removedIds` lists the shows that stopped airing.
+    added, removed, changed = diffSchedules(previous['schedule'], schedule)
+    currentIds = scheduleIds(schedule)
+    airing = set(currentIds)
+    
+    changedDetails = {}
+    for mal_id in currentIds:
+        rendered = convert_decimals_to_floats(airingDetails(details[mal_id]))
+        if mal_id not in previous['details'] or rendered != convert_decimals_to_floats(airingDetails(previous['details'][mal_id])):
+            changedDetails[str(mal_id)] = rendered
+    
+    return dumps({
+        'base': previous['sha256'],
+        'version': version,
+        'added': added,
+        'removed': removed,
+        'changed': changed,
+        'details': changedDetails,
+        'removedIds': [mal_id for mal_id in scheduleIds(previous['schedule']) if mal_id not in airing]
+    }, separators=(',', ':'))
@@ -0,0 +1,68 @@
+import os
+import re
+from bs4 import BeautifulSoup
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday','Friday', 'Saturday', 'Sunday']
+# Bracket search
+bracketPattern = re.compile(r'\((.*?)\)')
+# Regular expression pattern to extract episode counts and types
+pattern = re.compile(r'([A-Za-z\s]+):\s(\d+)/(\d+)')
+
+# lxml is a lot faster than the builtin parser on the large forum page
+forumParser = os.environ.get('FORUM_PARSER', 'lxml' if lxml != None else 'html.parser')
+
+def parseForumPage(html: str, parser: str = None):
+    soup = BeautifulSoup(html, parser or forumParser)
+    
+    # Find the heading of every day in a single pass over the tree
+    dayTags = {}
+    for dayTag in soup.find_all(string=days):
+        dayTags.setdefault(str(dayTag), dayTag)
+    
+    animes = {}
+    for day in days:
+        if day not in dayTags:
+            raise ValueError(f'Could not find {day} on the forum page')
+        animes[day] = parseWeekList(dayTags[day], day)
+    return animes
+
+def parseWeekList(dayTag, dayOfWeek: str):
+    dayResults = []
+    print(f'Searching for anime for {dayOfWeek}')
+    listTag = dayTag.parent.ul
+    if listTag != None:
+        print('Found anime entries')
+        for tag in listTag.find_all('li'):
+            aTag = tag.find('a')
+            if aTag == None:
+                continue
+
+            href = aTag.get('href')
+            id_start_index = href.find("/anime/") + len("/anime/")
+            id_end_index = href.find("/", id_start_index)
+            mal_id = int(href[id_start_index:id_end_index])
+            anime_name = aTag.string
+
+            episodes = []
+            match = bracketPattern.search(tag.text)
+            if match:
+                content = match.group(1)
+                # Extract episode counts and types from string1
+                episodeProgress = pattern.findall(content)
+                for source, curr, total in episodeProgress:
+                    episodes.append({
+                        source.strip(): {'current': curr, 'total': total}
+                    })
+            
+            anime = {
+                'mal_id': mal_id,
+                'name': anime_name,
+                'episodes': episodes
+            }
+            dayResults.append(anime)
+    
+    return dayResults
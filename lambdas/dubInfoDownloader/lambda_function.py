@@ -1,200 +1,305 @@
 import boto3
+from botocore.exceptions import ClientError
 import logging
+import urllib.error
 import urllib.request
-from mal import Anime
-from bs4 import BeautifulSoup
-import re
 import json
-from datetime import datetime, timedelta
-import sys
-from decimal import Decimal
+import os
+import time
+import hashlib
+import tempfile
+import gzip
+import io
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from anime_cache import AnimeCache, call_mal, create_backend, metrics, publish_prefix_index
+from currently_airing import buildCurrentlyAiring, buildCurrentlyAiringDelta, buildLegacyCurrentlyAiring, diffSchedules, scheduleIds, splitLegacyCurrentlyAiring
+from forum_parser import parseForumPage
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 logger.info('Loading function')
 
-sns_client = boto3.client('sns')
-dubInfoUrl = 'https://raw.githubusercontent.com/MAL-Dubs/MAL-Dubs/main/data/dubInfo.json'
+dubInfoUrl = os.environ.get('DUB_INFO_URL', 'https://raw.githubusercontent.com/MAL-Dubs/MAL-Dubs/main/data/dubInfo.json')
 bucketName = 'www.animedubstatus.com'
 fileName = 'dubInfo.json'
 
+# dubInfo.json is streamed in chunks and only spills to disk past this size
+downloadChunkSize = 64 * 1024
+downloadMaxMemory = int(os.environ.get('DOWNLOAD_MAX_MEMORY', str(1024 * 1024)))
+
+# Every JSON file is also published pre-compressed next to the original, e.g.
+# dubInfo.json.gz and dubInfo.json.br
+staticCacheControl = os.environ.get('STATIC_CACHE_CONTROL', 'public, max-age=3600')
+dubInfoIndexFileName = 'dubInfoIndex.json'
+
+# currentlyAiring.v2.json is the normalized schedule. The original format with
+# the full details embedded is kept until the frontend has moved over.
+currentlyAiringFileName = 'currentlyAiring.v2.json'
+legacyCurrentlyAiringFileName = 'currentlyAiring.json'
+writeLegacyCurrentlyAiring = os.environ.get('WRITE_LEGACY_CURRENTLY_AIRING', 'true').lower() == 'true'
+# What changed since the previous run, for clients that already hold that version
+currentlyAiringDeltaFileName = 'currentlyAiring.delta.json'
+# Only new shows are resolved on a normal run, every show gets its details
+# resolved again once they are this old
+currentlyAiringRefreshHours = float(os.environ.get('CURRENTLY_AIRING_REFRESH_HOURS', '168'))
+
+# The prefix index animeSearch answers common queries from is built here, once
+# a run, rather than by scanning "anime-cache" on the search request path
+publishSearchIndex = os.environ.get('SEARCH_INDEX_ENABLED', 'true').lower() == 'true'
+
 s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('anime-cache')
+cache = AnimeCache(create_backend())
 
 def lambda_handler(event, context):
+    with metrics.request('dubInfoDownloader'):
+        return handle(event, context)
+
+def handle(event, context):
     try:
         pullDubInfo()
         pullCurrentlyAiring()
+        if publishSearchIndex:
+            index = publish_prefix_index(cache.backend)
+            print(f'Published prefix index over {len(index)} cached anime')
         return True
     except Exception as e:
         logging.error(e)
         raise e
+    finally:
+        # Write out anything still sitting in the batch write buffer
+        cache.flush()
     
 def pullDubInfo():
     logger.info(f'Grabbing dubInfo.json from {dubInfoUrl}')
-    with urllib.request.urlopen(dubInfoUrl) as f:
-        s3.upload_fileobj(f, bucketName, fileName)
+    start = time.time()
+    stored = getStoredDubInfo()
+    
+    # Only download when upstream has changed since our last copy
+    request = urllib.request.Request(dubInfoUrl)
+    if 'etag' in stored['metadata']:
+        request.add_header('If-None-Match', stored['metadata']['etag'])
+    if 'last-modified' in stored['metadata']:
+        request.add_header('If-Modified-Since', stored['metadata']['last-modified'])
+    
+    try:
+        with metrics.timer('DubInfo'):
+            response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise e
+        logDubInfoTransfer('not-modified', 0, stored, start)
+        return False
+    
+    with response, \
+            tempfile.SpooledTemporaryFile(max_size=downloadMaxMemory) as body, \
+            tempfile.SpooledTemporaryFile(max_size=downloadMaxMemory) as gzipBody, \
+            tempfile.SpooledTemporaryFile(max_size=downloadMaxMemory) as brotliBody:
+        # Compress while streaming so the whole file is never held in memory
+        gzipFile = gzip.GzipFile(fileobj=gzipBody, mode='wb', mtime=0)
+        brotliCompressor = brotli.Compressor() if brotli != None else None
+        
+        digest = hashlib.sha256()
+        transferred = 0
+        while True:
+            chunk = response.read(downloadChunkSize)
+            if not chunk:
+                break
+            digest.update(chunk)
+            body.write(chunk)
+            gzipFile.write(chunk)
+            if brotliCompressor != None:
+                brotliBody.write(brotliCompressor.process(chunk))
+            transferred += len(chunk)
+        gzipFile.close()
+        if brotliCompressor != None:
+            brotliBody.write(brotliCompressor.finish())
+        
+        # Some hosts ignore conditional requests so compare the content as well
+        contentHash = digest.hexdigest()
+        if contentHash == stored['metadata'].get('sha256'):
+            logDubInfoTransfer('unchanged', transferred, stored, start)
+            return False
+        
+        metadata = {
+            'sha256': contentHash,
+            'transfer-seconds': f'{time.time() - start:.3f}'
+        }
+        if response.headers.get('ETag'):
+            metadata['etag'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            metadata['last-modified'] = response.headers['Last-Modified']
+        
+        uploadStatic(body, fileName, metadata=metadata)
+        uploadStatic(gzipBody, f'{fileName}.gz', 'gzip')
+        if brotliCompressor != None:
+            uploadStatic(brotliBody, f'{fileName}.br', 'br')
+        
+        body.seek(0)
+        putStaticJson(dubInfoIndexFileName, buildDubInfoIndex(json.load(body)))
+    
+    metrics.increment('DubInfoBytes', transferred)
+    logDubInfoTransfer('uploaded', transferred, stored, start)
     return True
+
+def getStoredDubInfo():
+    # The validators of the last upload are kept as metadata on the S3 object
+    try:
+        with metrics.timer('S3'):
+            head = s3.head_object(Bucket=bucketName, Key=fileName)
+        return {'metadata': head.get('Metadata', {}), 'size': head.get('ContentLength', 0)}
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise e
+        return {'metadata': {}, 'size': 0}
+
+def logDubInfoTransfer(outcome, transferred, stored, start):
+    elapsed = time.time() - start
+    # Skipping the upload saves roughly what the last full transfer cost
+    savedSeconds = 0.0
+    if outcome != 'uploaded':
+        savedSeconds = max(float(stored['metadata'].get('transfer-seconds', '0')) - elapsed, 0.0)
+    logger.info(json.dumps({
+        'event': 'dubInfoTransfer',
+        'outcome': outcome,
+        'bytesTransferred': transferred,
+        'bytesSkipped': stored['size'] if outcome == 'not-modified' else 0,
+        'seconds': round(elapsed, 3),
+        'secondsSaved': round(savedSeconds, 3)
+    }))
+    
+def buildDubInfoIndex(dubInfo):
+    # A minified mal_id -> dub status lookup, where the status is an index into
+    # `statuses` (e.g. "dubbed", "incomplete")
+    statuses = [key for key, value in dubInfo.items() if isinstance(value, list)]
+    ids = {}
+    for status, key in enumerate(statuses):
+        for mal_id in dubInfo[key]:
+            ids.setdefault(str(mal_id), status)
+    return json.dumps({'statuses': statuses, 'ids': ids}, separators=(',', ':'))
+
+def uploadStatic(fileobj, key, contentEncoding=None, metadata=None):
+    extraArgs = {
+        'ContentType': 'application/json',
+        'CacheControl': staticCacheControl
+    }
+    if contentEncoding != None:
+        extraArgs['ContentEncoding'] = contentEncoding
+    if metadata != None:
+        extraArgs['Metadata'] = metadata
+    
+    fileobj.seek(0)
+    with metrics.timer('S3'):
+        s3.upload_fileobj(fileobj, bucketName, key, ExtraArgs=extraArgs)
+    metrics.increment('S3BytesWritten', fileobj.tell())
+
+def putStaticJson(key, body, metadata=None):
+    # Publishes the JSON along with its gzip and brotli encoded variants
+    data = body.encode('utf-8')
+    uploadStatic(io.BytesIO(data), key, metadata=metadata)
+    uploadStatic(io.BytesIO(gzip.compress(data, mtime=0)), f'{key}.gz', 'gzip')
+    if brotli != None:
+        uploadStatic(io.BytesIO(brotli.compress(data)), f'{key}.br', 'br')
+    print(f'Published {key} ({len(data)} bytes)')
     
 def pullCurrentlyAiring():
-    results = parseMyAnimeListForumPage()
-    s3.put_object(Body=results, Bucket=bucketName, Key='currentlyAiring.json')
+    schedule = parseMyAnimeListForumPage()
+    previous = getStoredCurrentlyAiring()
+    details, resolvedAt, resolved = resolveCurrentlyAiringDetails(schedule, previous)
+    
+    body = buildCurrentlyAiring(schedule, details)
+    version = hashlib.sha256(body.encode('utf-8')).hexdigest()
+    if previous != None and version == previous['sha256']:
+        print('Currently airing schedule is unchanged')
+        if resolvedAt != previous['resolvedAt']:
+            # Every show was just resolved again, remember that or the next
+            # runs would keep resolving them until the schedule changes
+            uploadStatic(io.BytesIO(body.encode('utf-8')), currentlyAiringFileName, metadata={'sha256': version, 'details-resolved-at': str(resolvedAt)})
+        if writeLegacyCurrentlyAiring and len(resolved) > 0:
+            # The v2 file only has a few fields of the details, the legacy one
+            # embeds all of them and those may have changed
+            putStaticJson(legacyCurrentlyAiringFileName, buildLegacyCurrentlyAiring(schedule, details))
+        return False
+    
+    putStaticJson(currentlyAiringFileName, body, {'sha256': version, 'details-resolved-at': str(resolvedAt)})
+    if previous != None:
+        added, removed, changed = diffSchedules(previous['schedule'], schedule)
+        logger.info(json.dumps({
+            'event': 'currentlyAiringDiff',
+            'added': sum(len(dayAnimes) for dayAnimes in added.values()),
+            'removed': sum(len(dayIds) for dayIds in removed.values()),
+            'changed': sum(len(dayAnimes) for dayAnimes in changed.values())
+        }))
+        putStaticJson(currentlyAiringDeltaFileName, buildCurrentlyAiringDelta(previous, schedule, details, version))
+    if writeLegacyCurrentlyAiring:
+        putStaticJson(legacyCurrentlyAiringFileName, buildLegacyCurrentlyAiring(schedule, details))
     return True
 
+def getStoredCurrentlyAiring():
+    # The previous run's schedule and details, or None on the first run
+    stored = getStaticJson(currentlyAiringFileName)
+    if stored == None or 'sha256' not in stored['metadata']:
+        return None
+    
+    previous = {
+        'schedule': stored['body']['schedule'],
+        'details': {int(mal_id): anime for mal_id, anime in stored['body']['details'].items()},
+        'sha256': stored['metadata']['sha256'],
+        'resolvedAt': float(stored['metadata'].get('details-resolved-at', '0'))
+    }
+    if writeLegacyCurrentlyAiring:
+        # The legacy file embeds the full details, which the v2 file only has a few fields of
+        legacy = getStaticJson(legacyCurrentlyAiringFileName)
+        if legacy == None:
+            return None
+        previous['details'] = splitLegacyCurrentlyAiring(legacy['body'])[1]
+    return previous
+
+def getStaticJson(key):
+    try:
+        with metrics.timer('S3'):
+            response = s3.get_object(Bucket=bucketName, Key=key)
+            body = json.load(response['Body'])
+        return {'body': body, 'metadata': response.get('Metadata', {})}
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise e
+        return None
+
+def resolveCurrentlyAiringDetails(schedule, previous):
+    # Shows that were airing on the previous run keep their details, so only new
+    # shows touch MAL. Everything is resolved again periodically. Also returns
+    # the ids that were resolved.
+    mal_ids = scheduleIds(schedule)
+    now = int(time.time())
+    if previous == None or now - previous['resolvedAt'] > currentlyAiringRefreshHours * 3600:
+        print(f'Resolving details for {len(mal_ids)} airing anime')
+        metrics.increment('AiringResolved', len(mal_ids))
+        return cache.get_or_put_animes(mal_ids), now, mal_ids
+    
+    details = {mal_id: previous['details'][mal_id] for mal_id in mal_ids if mal_id in previous['details']}
+    newIds = [mal_id for mal_id in mal_ids if mal_id not in details]
+    # Reusing the details doesn't keep the shows in "anime-cache". Continuing
+    # shows whose item is missing or close to expiring are resolved again, one
+    # cheap read of the freshness attributes tells which.
+    expiringIds = cache.find_uncached(list(details)) if len(details) > 0 else []
+    resolved = newIds + expiringIds
+    print(f'Resolving details for {len(newIds)} newly airing and {len(expiringIds)} expiring anime, reusing {len(details) - len(expiringIds)}')
+    if len(resolved) > 0:
+        # One batched read, the misses are all fetched together
+        details.update(cache.get_or_put_animes(resolved))
+    metrics.increment('AiringResolved', len(resolved))
+    return details, int(previous['resolvedAt']), resolved
 
-days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday','Friday', 'Saturday', 'Sunday']
-# Bracket search
-bracketPattern = r'\((.*?)\)'
-# Regular expression pattern to extract episode counts and types
-pattern = r'([A-Za-z\s]+):\s(\d+)/(\d+)'
 
 currentlyAiringUrl = 'https://myanimelist.net/forum/?topicid=1692966'
 
 def parseMyAnimeListForumPage():
     logger.info('Grabbing currently airing information')
-    animes = {}
 
-    with urllib.request.urlopen(currentlyAiringUrl) as response:
+    with call_mal(urllib.request.urlopen, currentlyAiringUrl) as response:
         html = response.read().decode("utf-8")
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        for day in days:
-            dayAnimes = parseWeekList(soup, day)
-            animes[day] = dayAnimes
-    return json.dumps(animes)
-            
-
-def parseWeekList(soup: BeautifulSoup, dayOfWeek: str):
-    dayResults = []
-    print(f'Searching for anime for {dayOfWeek}')
-    dayTag = soup.find(string=dayOfWeek)
-    listTag = dayTag.parent.ul
-    if listTag != None:
-        print('Found anime entries')
-        for tag in listTag.find_all('li'):
-            aTag = tag.find('a')
-            if aTag == None:
-                continue
-
-            href = aTag.get('href')
-            id_start_index = href.find("/anime/") + len("/anime/")
-            id_end_index = href.find("/", id_start_index)
-            mal_id = int(href[id_start_index:id_end_index])
-            anime_name = aTag.string
-
-            episodes = []
-            match = re.search(bracketPattern, tag.text)
-            if match:
-                content = match.group(1)
-                # Extract episode counts and types from string1
-                episodeProgress = re.findall(pattern, content)
-                for source, curr, total in episodeProgress:
-                    episodes.append({
-                        source.strip(): {'current': curr, 'total': total}
-                    })
-            
-            anime_details = get_or_put_anime(mal_id)
-            
-            anime = {
-                'mal_id': mal_id,
-                'name': anime_name,
-                'episodes': episodes,
-                'details': anime_details
-            }
-            dayResults.append(anime)
-    
-    return dayResults
-    
-def get_or_put_anime(mal_id):
-    # Check if the item already exists in the "anime-cache" table
-    response = table.get_item(
-        Key={
-            'mal_id': mal_id
-        }
-    )
-    
-    # If the item exists
-    if 'Item' in response:
-        existing_item = convert_decimals_to_floats(response['Item'])
-        print(f'Found anime with id {mal_id} in cache')
-        return existing_item
-    else:
-        # Calculate the expiration time (1 week from the current time)
-        expiration_time = datetime.now() + timedelta(weeks=1)
-        expiration_timestamp = int(expiration_time.timestamp())
-        
-        anime = Anime(mal_id)
-        
-        anime_details = {
-                'mal_id': anime.mal_id,
-                'title': anime.title,
-                'title_english': anime.title_english,
-                'title_japanese': anime.title_japanese,
-                'title_synonyms': anime.title_synonyms,
-                'url': anime.url,
-                'image_url': anime.image_url,
-                'type': anime.type,
-                'status': anime.status,
-                'genres': anime.genres,
-                'themes': anime.themes,
-                'external_links': anime.external_links,
-                'score': anime.score,
-                'scored_by': anime.scored_by,
-                'rank': anime.rank,
-                'popularity': anime.popularity,
-                'members': anime.members,
-                'favorites': anime.favorites,
-                'episodes': anime.episodes,
-                'aired': anime.aired,
-                'premiered': anime.premiered,
-                'broadcast': anime.broadcast,
-                'producers': anime.producers,
-                'licensors': anime.licensors,
-                'studios': anime.studios,
-                'source': anime.source,
-                'duration': anime.duration,
-                'rating': anime.rating,
-                'related_anime': anime.related_anime,
-                'opening_themes': anime.opening_themes,
-                'ending_themes': anime.ending_themes,
-                'synopsis':  anime.synopsis,
-                'background': anime.background,
-                'ttl': expiration_timestamp
-            }
-        
-        
-        item = convert_floats_to_decimals(anime_details)
-        
-        # Store the new item in the "animes" table
-        table.put_item(Item=item)
-        
-        size_in_kb = get_dict_size(item)
-        print(f"Storing anime in cache with size: {size_in_kb:.2f} KB")
-        return anime_details
-        
-def get_dict_size(dictionary):
-    size_bytes = sys.getsizeof(dictionary)
-    size_kb = size_bytes / 1024
-    return size_kb
-    
-def convert_decimals_to_floats(data):
-    if isinstance(data, dict):
-        return {k: convert_decimals_to_floats(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_decimals_to_floats(item) for item in data]
-    elif isinstance(data, Decimal):
-        return float(data)
-    else:
-        return data
-        
-def convert_floats_to_decimals(data):
-    if isinstance(data, dict):
-        return {k: convert_floats_to_decimals(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_floats_to_decimals(item) for item in data]
-    elif isinstance(data, float):
-        return Decimal(str(data))
-    else:
-        return data
\ No newline at end of file
+    return parseForumPage(html)
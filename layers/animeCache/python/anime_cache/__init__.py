@@ -0,0 +1,72 @@
+from .backends import DynamoDBBackend, LocalBackend, MemoryBackend, create_backend
+from .cache import FRESHNESS_ATTRIBUTES, AnimeCache, is_complete, is_leased
+from .chunks import has_time_left, run_in_chunks
+from .clients import get_client, get_resource
+from .convert import (
+    DecimalEncoder,
+    convert_decimals_to_floats,
+    convert_floats_to_decimals,
+    dumps,
+    get_ids_from_string,
+)
+from .fetch import ANIME_FIELDS, build_anime_details, fetch_animes
+from .l1 import TTLCache
+from .metrics import Metrics, metrics
+from .refresh import create_refresher, publish_mal_ids
+from .search import (
+    PrefixIndex,
+    SearchResultCache,
+    build_prefix_index,
+    create_search_cache,
+    load_prefix_index,
+    normalize_query,
+    publish_prefix_index,
+)
+from .storage import decode_item, dynamodb_item_size, encode_item, migrate_items
+from .throttle import MalThrottle, MalUnavailable, call_mal, create_throttle, get_throttle
+from .writes import WriteBuffer
+
+__all__ = [
+    'ANIME_FIELDS',
+    'AnimeCache',
+    'DecimalEncoder',
+    'DynamoDBBackend',
+    'FRESHNESS_ATTRIBUTES',
+    'LocalBackend',
+    'MalThrottle',
+    'MalUnavailable',
+    'MemoryBackend',
+    'Metrics',
+    'PrefixIndex',
+    'SearchResultCache',
+    'TTLCache',
+    'WriteBuffer',
+    'build_anime_details',
+    'build_prefix_index',
+    'call_mal',
+    'convert_decimals_to_floats',
+    'convert_floats_to_decimals',
+    'create_backend',
+    'create_refresher',
+    'create_search_cache',
+    'create_throttle',
+    'decode_item',
+    'dumps',
+    'dynamodb_item_size',
+    'encode_item',
+    'fetch_animes',
+    'get_client',
+    'get_ids_from_string',
+    'get_resource',
+    'get_throttle',
+    'has_time_left',
+    'is_complete',
+    'is_leased',
+    'load_prefix_index',
+    'metrics',
+    'migrate_items',
+    'normalize_query',
+    'publish_mal_ids',
+    'publish_prefix_index',
+    'run_in_chunks',
+]
@@ -0,0 +1,345 @@
+import base64
+import copy
+import json
+import os
+import random
+import threading
+import time
+from decimal import Decimal
+
+from .clients import get_resource
+from .convert import dumps
+from .metrics import metrics
+
+# DynamoDB allows at most 100 keys per BatchGetItem request
+batchGetLimit = 100
+batchGetMaxAttempts = 8
+# and at most 25 puts per BatchWriteItem request
+batchWriteLimit = 25
+batchWriteMaxAttempts = 8
+
+
+def projection(attributes):
+    # Builds the ProjectionExpression arguments, aliasing every attribute since
+    # names like `ttl` are reserved words
+    if attributes == None:
+        return {}
+    return {
+        'ProjectionExpression': ', '.join(f'#a{i}' for i in range(len(attributes))),
+        'ExpressionAttributeNames': {f'#a{i}': name for i, name in enumerate(attributes)}
+    }
+
+
+class DynamoDBBackend:
+    # Items are stored as-is in the "anime-cache" table, keyed by mal_id
+
+    def __init__(self, table_name='anime-cache', dynamodb=None):
+        self.table_name = table_name
+        self.resource = dynamodb
+        self.table_resource = None
+
+    @property
+    def dynamodb(self):
+        # Created on first use so importing a lambda doesn't pay for boto3
+        if self.resource == None:
+            self.resource = get_resource('dynamodb')
+        return self.resource
+
+    @property
+    def table(self):
+        if self.table_resource == None:
+            self.table_resource = self.dynamodb.Table(self.table_name)
+        return self.table_resource
+
+    def get(self, mal_id, attributes=None):
+        with metrics.timer('DynamoDB'):
+            response = self.table.get_item(
+                Key={
+                    'mal_id': mal_id
+                },
+                **projection(attributes)
+            )
+        return response.get('Item')
+
+    def batch_get(self, mal_ids, attributes=None):
+        # Optionally only reads the given attributes of every item
+        items = {}
+        unprocessed = []
+        unique_ids = list(dict.fromkeys(mal_ids))
+
+        for start in range(0, len(unique_ids), batchGetLimit):
+            chunk = unique_ids[start:start + batchGetLimit]
+            request = {
+                self.table.name: {
+                    'Keys': [{'mal_id': mal_id} for mal_id in chunk],
+                    **projection(attributes)
+                }
+            }
+
+            attempt = 0
+            while request:
+                with metrics.timer('DynamoDB'):
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table.name, []):
+                    items[int(item['mal_id'])] = item
+
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+
+                attempt += 1
+                if attempt >= batchGetMaxAttempts:
+                    unprocessed.extend(int(key['mal_id']) for key in request[self.table.name]['Keys'])
+                    break
+
+                # Back off before retrying the keys DynamoDB could not serve
+                time.sleep(min(0.05 * (2 ** attempt), 1))
+
+        # DynamoDB kept throttling these keys so fall back to single reads
+        for mal_id in unprocessed:
+            item = self.get(mal_id, attributes)
+            if item != None:
+                items[mal_id] = item
+
+        return items
+
+    def put(self, item):
+        with metrics.timer('DynamoDB'):
+            self.table.put_item(Item=item)
+
+    def put_if_unchanged(self, item, ttl):
+        # Only replaces the stored item if it still has the given ttl and no one
+        # holds a fill lease on it, so a concurrent fill is never overwritten
+        condition = '#ttl = :ttl' if ttl != None else 'attribute_not_exists(#ttl)'
+        kwargs = {
+            'Item': item,
+            'ConditionExpression': f'{condition} AND attribute_not_exists(lease_until)',
+            'ExpressionAttributeNames': {
+                '#ttl': 'ttl'
+            }
+        }
+        if ttl != None:
+            kwargs['ExpressionAttributeValues'] = {
+                ':ttl': ttl
+            }
+        try:
+            with metrics.timer('DynamoDB'):
+                self.table.put_item(**kwargs)
+            return True
+        except self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def batch_put(self, items):
+        for start in range(0, len(items), batchWriteLimit):
+            request = {
+                self.table.name: [{'PutRequest': {'Item': item}} for item in items[start:start + batchWriteLimit]]
+            }
+
+            attempt = 0
+            while request:
+                with metrics.timer('DynamoDB'):
+                    response = self.dynamodb.batch_write_item(RequestItems=request)
+                request = response.get('UnprocessedItems')
+                if not request:
+                    break
+
+                attempt += 1
+                if attempt >= batchWriteMaxAttempts:
+                    # Still throttled, let put_item and its own retries have a go
+                    for unprocessed in request[self.table.name]:
+                        self.put(unprocessed['PutRequest']['Item'])
+                    break
+
+                # Exponential backoff with full jitter so throttled writers spread out
+                time.sleep(random.uniform(0, min(0.05 * (2 ** attempt), 2)))
+
+    def scan(self, attributes=None):
+        # Walks the whole table, optionally only reading the given attributes
+        kwargs = projection(attributes)
+        while True:
+            with metrics.timer('DynamoDB'):
+                response = self.table.scan(**kwargs)
+            for item in response.get('Items', []):
+                yield item
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def acquire_lease(self, mal_id, owner, lease_until, now, placeholder_ttl):
+        # Only one caller may fill an item at a time. A missing item is created as
+        # a placeholder holding just the lease, which the full put_item replaces.
+        try:
+            with metrics.timer('DynamoDB'):
+                self.table.update_item(
+                    Key={
+                        'mal_id': mal_id
+                    },
+                    UpdateExpression='SET lease_owner = :owner, lease_until = :until, #ttl = if_not_exists(#ttl, :ttl)',
+                    ConditionExpression='attribute_not_exists(lease_until) OR lease_until < :now',
+                    ExpressionAttributeNames={
+                        '#ttl': 'ttl'
+                    },
+                    ExpressionAttributeValues={
+                        ':owner': owner,
+                        ':until': lease_until,
+                        ':now': now,
+                        ':ttl': placeholder_ttl
+                    }
+                )
+            return True
+        except self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def release_lease(self, mal_id, owner):
+        try:
+            with metrics.timer('DynamoDB'):
+                self.table.update_item(
+                    Key={
+                        'mal_id': mal_id
+                    },
+                    UpdateExpression='REMOVE lease_owner, lease_until',
+                    ConditionExpression='lease_owner = :owner',
+                    ExpressionAttributeValues={
+                        ':owner': owner
+                    }
+                )
+        except self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+def project(item, attributes):
+    if attributes != None:
+        item = {k: v for k, v in item.items() if k in attributes}
+    return copy.deepcopy(item)
+
+
+class MemoryBackend:
+    # Keeps items in a dict for the lifetime of the process
+
+    def __init__(self, items=None):
+        self.items = {}
+        self.lock = threading.Lock()
+        for item in (items or []):
+            self.items[int(item['mal_id'])] = copy.deepcopy(item)
+
+    def get(self, mal_id, attributes=None):
+        with self.lock:
+            item = self.items.get(mal_id)
+            return project(item, attributes) if item != None else None
+
+    def batch_get(self, mal_ids, attributes=None):
+        with self.lock:
+            return {
+                mal_id: project(self.items[mal_id], attributes)
+                for mal_id in dict.fromkeys(mal_ids)
+                if mal_id in self.items
+            }
+
+    def put(self, item):
+        with self.lock:
+            self.items[int(item['mal_id'])] = copy.deepcopy(item)
+
+    def put_if_unchanged(self, item, ttl):
+        with self.lock:
+            stored = self.items.get(int(item['mal_id']))
+            if stored == None or stored.get('ttl') != ttl or 'lease_until' in stored:
+                return False
+            self.items[int(item['mal_id'])] = copy.deepcopy(item)
+            return True
+
+    def batch_put(self, items):
+        for item in items:
+            self.put(item)
+
+    def scan(self, attributes=None):
+        with self.lock:
+            items = list(self.items.values())
+        for item in items:
+            yield project(item, attributes)
+
+    def acquire_lease(self, mal_id, owner, lease_until, now, placeholder_ttl):
+        with self.lock:
+            item = self.items.setdefault(mal_id, {'mal_id': mal_id})
+            if 'lease_until' in item and item['lease_until'] >= now:
+                return False
+            item['lease_owner'] = owner
+            item['lease_until'] = lease_until
+            item.setdefault('ttl', placeholder_ttl)
+            return True
+
+    def release_lease(self, mal_id, owner):
+        with self.lock:
+            item = self.items.get(mal_id)
+            if item != None and item.get('lease_owner') == owner:
+                item.pop('lease_owner', None)
+                item.pop('lease_until', None)
+
+
+class LocalBackend(MemoryBackend):
+    # A local stand-in for DynamoDB that persists items to a JSON file
+
+    def __init__(self, path='anime-cache.json'):
+        self.path = path
+        items = []
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                items = json.load(f, parse_float=Decimal, object_hook=decode_binary)
+        super().__init__(items)
+
+    def put(self, item):
+        super().put(item)
+        self.save()
+
+    def put_if_unchanged(self, item, ttl):
+        replaced = super().put_if_unchanged(item, ttl)
+        if replaced:
+            self.save()
+        return replaced
+
+    def batch_put(self, items):
+        # Save once for the whole batch rather than once per item
+        for item in items:
+            MemoryBackend.put(self, item)
+        self.save()
+
+    def acquire_lease(self, mal_id, owner, lease_until, now, placeholder_ttl):
+        acquired = super().acquire_lease(mal_id, owner, lease_until, now, placeholder_ttl)
+        self.save()
+        return acquired
+
+    def release_lease(self, mal_id, owner):
+        super().release_lease(mal_id, owner)
+        self.save()
+
+    def save(self):
+        with self.lock:
+            with open(self.path, 'w') as f:
+                f.write(dumps(list(self.items.values()), default=encode_binary))
+
+
+def encode_binary(value):
+    # Binary attributes, e.g. the packed blob of compact items, as base64
+    if isinstance(value, (bytes, bytearray)):
+        return {'__binary__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def decode_binary(value):
+    if '__binary__' in value:
+        return base64.b64decode(value['__binary__'])
+    return value
+
+
+def create_backend(name=None):
+    # Picks the backend from ANIME_CACHE_BACKEND, defaulting to DynamoDB
+    if name == None:
+        name = os.environ.get('ANIME_CACHE_BACKEND', 'dynamodb')
+
+    if name == 'dynamodb':
+        return DynamoDBBackend(os.environ.get('ANIME_CACHE_TABLE', 'anime-cache'))
+    elif name == 'memory':
+        return MemoryBackend()
+    elif name == 'local':
+        return LocalBackend(os.environ.get('ANIME_CACHE_PATH', 'anime-cache.json'))
+    else:
+        raise ValueError(f'Unknown anime cache backend "{name}"')
@@ -0,0 +1,278 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from .fetch import build_anime_details, fetch_animes, malFetchConcurrency
+from .metrics import metrics
+from .storage import HOT_FIELDS, PACKED_ATTRIBUTE, decode_item, dynamodb_item_size, encode_item
+from .writes import WriteBuffer
+
+# Single-flight fills: the caller holding the lease on an item scrapes MAL while
+# everyone else polls the table for up to fillWaitSeconds before giving up
+fillLeaseSeconds = int(os.environ.get('FILL_LEASE_SECONDS', '30'))
+fillWaitSeconds = float(os.environ.get('FILL_WAIT_SECONDS', '3'))
+fillPollInterval = float(os.environ.get('FILL_POLL_INTERVAL', '0.25'))
+
+# Items are refreshed once they are older than the soft expiry, well before
+# DynamoDB deletes them through the hard `ttl`
+softTtlHours = int(os.environ.get('SOFT_TTL_HOURS', '24'))
+# Items this close to their soft expiry already count as needing a refresh
+refreshMarginHours = float(os.environ.get('REFRESH_MARGIN_HOURS', '1'))
+
+# Just enough of an item to tell whether it is cached and still fresh
+FRESHNESS_ATTRIBUTES = ['mal_id', 'title', 'ttl', 'soft_expiry', 'lease_until']
+
+# Bookkeeping attributes that are never handed back to callers
+LEASE_ATTRIBUTES = ('lease_owner', 'lease_until')
+
+
+def is_complete(item):
+    # Placeholders written while acquiring a lease only hold the key and lease
+    return 'title' in item
+
+
+def is_leased(item, now):
+    # Someone is already filling this one
+    return item != None and item.get('lease_until', 0) >= now
+
+
+def strip_lease(item):
+    return {k: v for k, v in item.items() if k not in LEASE_ATTRIBUTES}
+
+
+def projection_attributes(fields):
+    # The attributes to read for the requested fields. The freshness attributes
+    # are always needed, and in the compact format most fields live in the
+    # packed blob.
+    if fields == None:
+        return None
+    attributes = list(dict.fromkeys(FRESHNESS_ATTRIBUTES + list(fields)))
+    if any(field not in HOT_FIELDS for field in fields):
+        attributes.append(PACKED_ATTRIBUTE)
+    return attributes
+
+
+def trim(anime, fields):
+    return {field: anime[field] for field in fields if field in anime}
+
+
+class AnimeCache:
+    # The read/miss/fill path shared by every lambda that touches "anime-cache"
+
+    def __init__(self, backend, loader=None, ttl=timedelta(weeks=1), l1=None, soft_ttl=None, refresher=None, storage_format=None):
+        self.backend = backend
+        self.storage_format = storage_format
+        self.loader = loader
+        self.ttl = ttl
+        self.soft_ttl = soft_ttl if soft_ttl != None else timedelta(hours=softTtlHours)
+        # Optional in-process TTLCache of already converted items
+        self.l1 = l1
+        # Optional callback taking a list of stale mal_ids. When set stale items
+        # are served right away and refreshed in the background, otherwise they
+        # are refreshed inline.
+        self.refresher = refresher
+        self.writes = WriteBuffer(backend)
+
+    def soft_expiry(self, item):
+        if 'soft_expiry' in item:
+            return int(item['soft_expiry'])
+        # Items cached before soft expiry existed only know their hard ttl
+        return int(int(item['ttl']) - self.ttl.total_seconds() + self.soft_ttl.total_seconds())
+
+    def is_stale(self, item, now):
+        return 'ttl' not in item or self.soft_expiry(item) <= now
+
+    def find_uncached(self, mal_ids):
+        # Returns the ids that are missing or close to expiring, leaving out the
+        # ones someone is already filling
+        cached = self.backend.batch_get(mal_ids, FRESHNESS_ATTRIBUTES)
+        now = int(time.time())
+        refresh_by = now + int(refreshMarginHours * 3600)
+
+        uncached = []
+        for mal_id in dict.fromkeys(mal_ids):
+            item = cached.get(mal_id)
+            if is_leased(item, now):
+                continue
+            if item == None or not is_complete(item) or self.is_stale(item, refresh_by):
+                uncached.append(mal_id)
+        return uncached
+
+    def get_or_put_anime(self, mal_id, fields=None):
+        return self.get_or_put_animes([mal_id], fields)[mal_id]
+
+    def get_or_put_animes(self, mal_ids, fields=None, errors=None, fetched=None):
+        # Look up every requested id at once and only go to MAL for the true misses.
+        # With `fields` only those fields are read from the table and returned.
+        # With an `errors` dict, ids that fail to load are recorded there and
+        # left out of the result instead of failing the whole batch. A `fetched`
+        # list gets the ids this call actually loaded from MAL.
+        mal_ids = list(dict.fromkeys(mal_ids))
+        attributes = projection_attributes(fields)
+
+        animes = {}
+        if self.l1 != None:
+            for mal_id in mal_ids:
+                anime = self.l1.get(mal_id)
+                if anime != None:
+                    animes[mal_id] = anime
+            metrics.increment('L1Hits', len(animes))
+
+        lookups = [mal_id for mal_id in mal_ids if mal_id not in animes]
+        cached = self.backend.batch_get(lookups, attributes) if len(lookups) > 0 else {}
+
+        now = int(time.time())
+        misses = []
+        pending = []
+        stale = {}
+        for mal_id in lookups:
+            item = cached.get(mal_id)
+            if item != None and is_complete(item):
+                print(f'Found anime with id {mal_id} in cache')
+                anime = decode_item(strip_lease(item))
+                if not self.is_stale(item, now):
+                    # Projected items are partial so they stay out of the L1
+                    animes[mal_id] = self.remember(anime) if fields == None else anime
+                else:
+                    stale[mal_id] = anime
+                    if self.refresher != None:
+                        animes[mal_id] = anime
+            elif is_leased(item, now):
+                # Someone else is already fetching this one
+                pending.append(mal_id)
+            else:
+                misses.append(mal_id)
+
+        metrics.increment('CacheHits', len(mal_ids) - len(misses) - len(pending))
+        metrics.increment('CacheMisses', len(misses) + len(pending))
+        metrics.increment('StaleItems', len(stale))
+
+        if len(stale) > 0 and self.refresher != None:
+            self.refresher(list(stale))
+            stale = {}
+
+        animes.update(self.fill_animes(misses, pending, stale, errors, fetched))
+        # Keep the order the ids were requested in
+        mal_ids = [mal_id for mal_id in mal_ids if mal_id in animes]
+        if fields != None:
+            return {mal_id: trim(animes[mal_id], fields) for mal_id in mal_ids}
+        return {mal_id: animes[mal_id] for mal_id in mal_ids}
+
+    def fill_animes(self, misses, pending=None, stale=None, errors=None, fetched=None):
+        # Stale items only get refreshed by whoever wins the lease, everyone else
+        # keeps serving the stale copy
+        stale = stale or {}
+        misses = misses + list(stale)
+
+        owner = str(uuid.uuid4())
+        now = int(time.time())
+        lease_until = now + fillLeaseSeconds
+        placeholder_ttl = now + fillLeaseSeconds * 2
+
+        won = []
+        lost = list(pending or [])
+        if len(misses) > 0:
+            workers = min(malFetchConcurrency, len(misses))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                leases = executor.map(
+                    lambda mal_id: self.backend.acquire_lease(mal_id, owner, lease_until, now, placeholder_ttl),
+                    misses
+                )
+                for mal_id, acquired in zip(misses, leases):
+                    (won if acquired else lost).append(mal_id)
+
+        animes = {mal_id: stale[mal_id] for mal_id in lost if mal_id in stale}
+        lost = [mal_id for mal_id in lost if mal_id not in stale]
+
+        failures = errors if errors != None else {}
+        animes.update(self.put_animes(won, owner, failures, fetched))
+        if len(lost) > 0:
+            print(f'Waiting on other callers to fill {lost}')
+            animes.update(self.wait_for_animes(lost, failures, fetched))
+
+        if errors != None:
+            return animes
+
+        # While MAL is failing a stale copy is better than nothing
+        for mal_id in stale:
+            if mal_id not in animes:
+                print(f'Failed to refresh anime with id {mal_id}, serving the stale copy')
+                animes[mal_id] = stale[mal_id]
+                failures.pop(mal_id, None)
+                metrics.increment('StaleServed')
+        if len(failures) > 0:
+            raise next(iter(failures.values()))
+        return animes
+
+    def wait_for_animes(self, mal_ids, errors=None, fetched=None):
+        animes = {}
+        remaining = list(mal_ids)
+        deadline = time.time() + fillWaitSeconds
+        while len(remaining) > 0 and time.time() < deadline:
+            time.sleep(fillPollInterval)
+            for mal_id, item in self.backend.batch_get(remaining).items():
+                if is_complete(item):
+                    animes[mal_id] = self.remember(decode_item(strip_lease(item)))
+            remaining = [mal_id for mal_id in remaining if mal_id not in animes]
+
+        # The other caller is taking too long so fetch these ourselves
+        if len(remaining) > 0:
+            print(f'Gave up waiting on {remaining}, fetching them directly')
+            animes.update(self.put_animes(remaining, errors=errors, fetched=fetched))
+        return animes
+
+    def put_animes(self, mal_ids, owner=None, errors=None, fetched=None):
+        try:
+            loaded = fetch_animes(mal_ids, self.loader, errors=errors)
+        except Exception:
+            # Let the next caller have a go instead of waiting out the lease
+            if owner != None:
+                for mal_id in mal_ids:
+                    self.backend.release_lease(mal_id, owner)
+            raise
+
+        if owner != None:
+            for mal_id in mal_ids:
+                if mal_id not in loaded:
+                    self.backend.release_lease(mal_id, owner)
+
+        animes = {}
+        for mal_id, anime in loaded.items():
+            animes[mal_id] = self.put_anime_details(anime)
+        if fetched != None:
+            fetched.extend(animes)
+        # Write this batch of fills right away so callers waiting on the leases
+        # don't have to wait for the end of the handler
+        self.flush()
+        return animes
+
+    def flush(self):
+        flushed = self.writes.flush()
+        if flushed > 0:
+            print(f'Wrote {flushed} anime to the cache')
+        return flushed
+
+    def put_anime_details(self, anime):
+        # Calculate the expiration time (1 week from the current time by default)
+        expiration_time = datetime.now() + self.ttl
+        expiration_timestamp = int(expiration_time.timestamp())
+
+        anime_details = build_anime_details(anime, expiration_timestamp)
+        anime_details['soft_expiry'] = int((datetime.now() + self.soft_ttl).timestamp())
+        item = encode_item(anime_details, self.storage_format)
+
+        # Queue the new item for the "anime-cache" table, writing it drops any lease
+        self.writes.add(item)
+
+        size_in_bytes = dynamodb_item_size(item)
+        metrics.record('ItemSize', size_in_bytes, 'Bytes')
+        print(f"Storing anime in cache with size: {size_in_bytes / 1024:.2f} KB")
+        return self.remember(anime_details)
+
+    def remember(self, anime):
+        if self.l1 != None:
+            expires_at = anime.get('soft_expiry', anime.get('ttl'))
+            self.l1.put(int(anime['mal_id']), anime, int(expires_at) if expires_at != None else None)
+        return anime
@@ -0,0 +1,26 @@
+import time
+
+
+def has_time_left(context, reserve_millis, longest_millis):
+    # Only start another chunk if one as slow as the slowest so far still fits
+    if context == None:
+        return True
+    return context.get_remaining_time_in_millis() - reserve_millis > longest_millis
+
+
+def run_in_chunks(items, chunk_size, process, context=None, reserve_millis=0):
+    # Calls `process` on consecutive chunks of `items` for as long as the Lambda
+    # invocation has time for another one, keeping `reserve_millis` back for
+    # whatever the handler does afterwards. `process` returns True to stop early.
+    # Returns the items that were never handed to `process`.
+    longest_millis = 0
+    for start in range(0, len(items), chunk_size):
+        if not has_time_left(context, reserve_millis, longest_millis):
+            return items[start:]
+
+        chunk_start = time.time()
+        stop = process(items[start:start + chunk_size])
+        longest_millis = max(longest_millis, (time.time() - chunk_start) * 1000)
+        if stop:
+            return items[start + chunk_size:]
+    return []
@@ -0,0 +1,17 @@
+from functools import lru_cache
+
+# boto3 takes a good part of a cold start to import, so it is only imported,
+# and every client only created, the first time something needs it. The
+# clients are then shared for the lifetime of the container.
+
+
+@lru_cache(maxsize=None)
+def get_resource(service_name):
+    import boto3
+    return boto3.resource(service_name)
+
+
+@lru_cache(maxsize=None)
+def get_client(service_name):
+    import boto3
+    return boto3.client(service_name)
@@ -0,0 +1,74 @@
+import json
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def decimal_default(value):
+    # DynamoDB hands every number back as a Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, value):
+        if isinstance(value, Decimal):
+            return decimal_default(value)
+        return super().default(value)
+
+
+def dumps(data, separators=None, default=None):
+    # Serializes items straight from DynamoDB, Decimals and all, in one pass.
+    # orjson is used when it is installed, its output is always compact.
+    # `default` gets any other value JSON has no type for, e.g. binary attributes.
+    encode = decimal_default
+    if default != None:
+        encode = lambda value: decimal_default(value) if isinstance(value, Decimal) else default(value)
+    if orjson != None:
+        return orjson.dumps(data, default=encode, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    if default != None:
+        return json.dumps(data, default=encode, separators=separators)
+    return json.dumps(data, cls=DecimalEncoder, separators=separators)
+
+
+def convert_decimals_to_floats(data, default=None):
+    # Whole numbers come back as ints, everything else as floats
+    return json.loads(dumps(data, default=default))
+
+
+def convert_floats_to_decimals(data):
+    if isinstance(data, dict):
+        return {k: convert_floats_to_decimals(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [convert_floats_to_decimals(item) for item in data]
+    elif isinstance(data, float):
+        return Decimal(str(data))
+    else:
+        return data
+
+
+def get_ids_from_string(string):
+    # Remove leading/trailing spaces from the string
+    string = string.strip()
+
+    # Check if the string is empty
+    if len(string) == 0:
+        return None
+
+    # Split the string by commas
+    numbers = string.split(',')
+
+    ids = []
+    # Check if each element is an integer
+    for num in numbers:
+        num = num.strip()
+        if not num.isdigit():
+            return None
+        else:
+            ids.append(int(num))
+
+    return ids
@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .throttle import call_mal
+
+# Cache misses are fetched from MAL concurrently, bounded by these settings
+malFetchConcurrency = int(os.environ.get('MAL_FETCH_CONCURRENCY', '8'))
+malFetchTimeout = int(os.environ.get('MAL_FETCH_TIMEOUT', '10'))
+
+# Every attribute of mal.Anime that we keep in the "anime-cache" table
+ANIME_FIELDS = [
+    'mal_id',
+    'title',
+    'title_english',
+    'title_japanese',
+    'title_synonyms',
+    'url',
+    'image_url',
+    'type',
+    'status',
+    'genres',
+    'themes',
+    'external_links',
+    'score',
+    'scored_by',
+    'rank',
+    'popularity',
+    'members',
+    'favorites',
+    'episodes',
+    'aired',
+    'premiered',
+    'broadcast',
+    'producers',
+    'licensors',
+    'studios',
+    'source',
+    'duration',
+    'rating',
+    'related_anime',
+    'opening_themes',
+    'ending_themes',
+    'synopsis',
+    'background',
+]
+
+
+def build_anime_details(anime, expiration_timestamp):
+    anime_details = {field: getattr(anime, field) for field in ANIME_FIELDS}
+    anime_details['ttl'] = expiration_timestamp
+    return anime_details
+
+
+def timed_load(loader, mal_id, timeout):
+    # Paced by the shared MAL throttle, which also times the call
+    return call_mal(loader, mal_id, timeout=timeout)
+
+
+def fetch_animes(mal_ids, loader=None, concurrency=None, timeout=None, errors=None):
+    # Every MAL lookup is a blocking scrape so run them side by side, capped by
+    # malFetchConcurrency. The loader can be swapped for a local stub. When an
+    # `errors` dict is passed failed ids are recorded in it and left out of the
+    # result, otherwise the first failure is raised.
+    animes = {}
+    if len(mal_ids) == 0:
+        return animes
+    if loader == None:
+        # mal pulls in requests and bs4, only load it once there is a miss
+        from mal import Anime
+        loader = Anime
+    if concurrency == None:
+        concurrency = malFetchConcurrency
+    if timeout == None:
+        timeout = malFetchTimeout
+
+    workers = min(concurrency, len(mal_ids))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(timed_load, loader, mal_id, timeout): mal_id
+            for mal_id in mal_ids
+        }
+        for future in as_completed(futures):
+            mal_id = futures[future]
+            if errors == None:
+                animes[mal_id] = future.result()
+                continue
+            try:
+                animes[mal_id] = future.result()
+            except Exception as e:
+                print(f'Failed to fetch anime with id {mal_id}: {e!r}')
+                errors[mal_id] = e
+    return animes
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults for the in-process cache kept by warm Lambda containers
+l1CacheSize = int(os.environ.get('L1_CACHE_SIZE', '512'))
+l1CacheMaxAge = int(os.environ.get('L1_CACHE_MAX_AGE', '300'))
+
+
+class TTLCache:
+    # A bounded LRU that also drops entries once they expire. Values are handed
+    # out as-is so callers must not mutate what they get back.
+
+    def __init__(self, max_size=None, max_age=None):
+        self.max_size = max_size if max_size != None else l1CacheSize
+        self.max_age = max_age if max_age != None else l1CacheMaxAge
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, expires_at=None):
+        # Never keep an entry past its own expiry, e.g. the item's DynamoDB `ttl`
+        max_expires_at = time.time() + self.max_age
+        if expires_at == None or expires_at > max_expires_at:
+            expires_at = max_expires_at
+
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'hit_ratio': self.hits / lookups if lookups > 0 else 0.0
+            }
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Metrics are written as CloudWatch Embedded Metric Format log lines, which
+# CloudWatch turns into metrics without any API calls
+metricsNamespace = os.environ.get('METRICS_NAMESPACE', 'AnimeDubStatus')
+metricsEnabled = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# EMF takes at most this many values per metric in one document
+MAX_VALUES = 100
+
+
+class Metrics:
+    # Collects counters and timings for one handler invocation at a time
+
+    def __init__(self, namespace=None, sink=None):
+        self.namespace = namespace if namespace != None else metricsNamespace
+        # Receives every EMF document, swap it for e.g. list.append in tests
+        self.sink = sink if sink != None else print
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, function=None):
+        with self.lock:
+            self.function = function
+            self.values = {}
+            self.units = {}
+
+    def record(self, name, value, unit='None'):
+        with self.lock:
+            self.values.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.values.setdefault(name, [0])[0] += value
+            self.units[name] = 'Count'
+
+    def count(self, name):
+        with self.lock:
+            return sum(self.values.get(name, []))
+
+    @contextmanager
+    def timer(self, name):
+        # Counts the calls to a dependency, e.g. "DynamoDB" or "MAL", and how long they took
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.increment(f'{name}Calls')
+            self.record(f'{name}Latency', (time.perf_counter() - start) * 1000, 'Milliseconds')
+
+    @contextmanager
+    def request(self, function):
+        # Wraps a handler invocation and emits everything recorded during it
+        self.reset(function)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.record('HandlerDuration', (time.perf_counter() - start) * 1000, 'Milliseconds')
+            lookups = self.count('CacheHits') + self.count('CacheMisses')
+            if lookups > 0:
+                self.record('CacheHitRatio', self.count('CacheHits') / lookups * 100, 'Percent')
+            self.emit()
+
+    def documents(self):
+        # Longer series are spread over as many documents as they need,
+        # counters and single values only go in the first one
+        with self.lock:
+            values = {name: list(value) for name, value in self.values.items()}
+            units = dict(self.units)
+            function = self.function
+
+        longest = max([len(value) for value in values.values()] + [1])
+        documents = []
+        for start in range(0, longest, MAX_VALUES):
+            part = {name: value[start:start + MAX_VALUES] for name, value in values.items() if len(value) > start}
+            document = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [['Function']],
+                        'Metrics': [{'Name': name, 'Unit': units[name]} for name in part]
+                    }]
+                },
+                'Function': function or 'unknown'
+            }
+            for name, value in part.items():
+                document[name] = value[0] if len(value) == 1 else value
+            documents.append(document)
+        return documents
+
+    def emit(self):
+        if metricsEnabled:
+            for document in self.documents():
+                self.sink(json.dumps(document))
+
+metrics = Metrics()
@@ -0,0 +1,37 @@
+import json
+import os
+
+from .clients import get_client
+from .metrics import metrics
+
+
+def publish_mal_ids(mal_ids, topic_arn=None, attempt=None):
+    # Hands the ids to animeCaching through the CacheAnimeTopic SNS topic.
+    # `attempt` counts how often animeCaching has already put them back.
+    if topic_arn == None:
+        topic_arn = os.environ['CacheAnimeTopic']
+
+    message = {
+        'mal_ids': mal_ids
+    }
+    if attempt != None:
+        message['attempt'] = attempt
+    with metrics.timer('SNS'):
+        get_client('sns').publish(
+            TopicArn=topic_arn,
+            Message=json.dumps(message)
+        )
+
+
+def create_refresher(topic_arn=None):
+    # Returns a callback that queues background refreshes, or None when there is
+    # no topic configured so stale items get refreshed inline instead
+    if topic_arn == None:
+        topic_arn = os.environ.get('CacheAnimeTopic')
+    if topic_arn == None:
+        return None
+
+    def refresher(mal_ids):
+        print(f'Queueing refresh of stale anime ids {mal_ids}')
+        publish_mal_ids(mal_ids, topic_arn)
+    return refresher
@@ -0,0 +1,198 @@
+import bisect
+import gzip
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from .clients import get_client, get_resource
+from .convert import convert_floats_to_decimals, dumps
+from .l1 import TTLCache
+from .metrics import metrics
+from .storage import PACKED_ATTRIBUTE, decode_item
+
+# Search results are cached per normalized query for this long
+searchCacheTtlHours = int(os.environ.get('SEARCH_CACHE_TTL_HOURS', '24'))
+
+# The fields animeSearch returns for every result
+SEARCH_RESULT_FIELDS = ['mal_id', 'title', 'url', 'image_url', 'type', 'score', 'synopsis']
+# What the prefix index keeps of every title, and reads from "anime-cache"
+SEARCH_INDEX_FIELDS = SEARCH_RESULT_FIELDS + ['title_english', 'title_synonyms', 'popularity']
+SEARCH_INDEX_ATTRIBUTES = SEARCH_INDEX_FIELDS + [PACKED_ATTRIBUTE]
+
+# The prefix index is built off the request path, by dubInfoDownloader, and
+# published to S3 as gzipped JSON for animeSearch to load
+searchIndexBucket = os.environ.get('SEARCH_INDEX_BUCKET', 'www.animedubstatus.com')
+searchIndexKey = os.environ.get('SEARCH_INDEX_KEY', 'searchIndex.json.gz')
+
+
+def normalize_query(query):
+    # "  Attack on   TITAN " and "attack on titan" share one cache entry
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+class SearchResultCache:
+    # Query -> results with a TTL, kept in DynamoDB with an in-process layer in front
+
+    def __init__(self, table_name=None, ttl=None, l1=None, dynamodb=None):
+        self.ttl = ttl if ttl != None else timedelta(hours=searchCacheTtlHours)
+        self.l1 = l1 if l1 != None else TTLCache()
+        self.table_name = table_name
+        self.dynamodb = dynamodb
+        self.table_resource = None
+
+    @property
+    def table(self):
+        # Without a table name results only live in the L1
+        if self.table_name != None and self.table_resource == None:
+            dynamodb = self.dynamodb if self.dynamodb != None else get_resource('dynamodb')
+            self.table_resource = dynamodb.Table(self.table_name)
+        return self.table_resource
+
+    def get(self, query):
+        results = self.l1.get(query)
+        if results != None or self.table == None:
+            return results
+
+        with metrics.timer('DynamoDB'):
+            item = self.table.get_item(
+                Key={
+                    'query': query
+                }
+            ).get('Item')
+        # DynamoDB only deletes expired items eventually
+        if item == None or item['ttl'] <= time.time():
+            return None
+
+        results = item['results']
+        self.l1.put(query, results, int(item['ttl']))
+        return results
+
+    def put(self, query, results):
+        expiration_timestamp = int((datetime.now() + self.ttl).timestamp())
+        self.l1.put(query, results, expiration_timestamp)
+        if self.table != None:
+            with metrics.timer('DynamoDB'):
+                self.table.put_item(Item={
+                    'query': query,
+                    'results': convert_floats_to_decimals(results),
+                    'ttl': expiration_timestamp
+                })
+
+
+def create_search_cache(name=None):
+    # Mirrors create_backend, only the DynamoDB backend persists search results
+    if name == None:
+        name = os.environ.get('ANIME_CACHE_BACKEND', 'dynamodb')
+
+    if name == 'dynamodb':
+        return SearchResultCache(os.environ.get('SEARCH_CACHE_TABLE', 'anime-search-cache'))
+    return SearchResultCache()
+
+
+class PrefixIndex:
+    # Answers queries from titles and synonyms we already hold in "anime-cache".
+    # Every word suffix of a name is indexed, so "titan" finds "Attack on Titan".
+
+    def __init__(self, items, built_at=None, etag=None):
+        self.items = []
+        self.results = {}
+        self.popularity = {}
+        entries = set()
+        for item in items:
+            if 'title' not in item:
+                continue
+            item = decode_item(item)
+            mal_id = int(item['mal_id'])
+            self.items.append({field: item.get(field) for field in SEARCH_INDEX_FIELDS})
+            self.results[mal_id] = {field: item.get(field) for field in SEARCH_RESULT_FIELDS}
+            self.results[mal_id]['mal_id'] = mal_id
+            self.popularity[mal_id] = item.get('popularity') or float('inf')
+
+            names = [item.get('title'), item.get('title_english')] + list(item.get('title_synonyms') or [])
+            for name in names:
+                if not name:
+                    continue
+                words = normalize_query(name).split(' ')
+                for start in range(len(words)):
+                    entries.add((' '.join(words[start:]), start == 0, mal_id))
+
+        self.keys = sorted(entries)
+        self.built_at = built_at if built_at != None else time.time()
+        # The ETag of the published copy this index was loaded from
+        self.etag = etag
+
+    def __len__(self):
+        return len(self.results)
+
+    def search(self, query, limit=20):
+        query = normalize_query(query)
+        if len(query) == 0:
+            return []
+
+        exact = []
+        full = []
+        partial = []
+        position = bisect.bisect_left(self.keys, (query,))
+        while position < len(self.keys) and self.keys[position][0].startswith(query):
+            key, from_start, mal_id = self.keys[position]
+            if key == query and from_start:
+                exact.append(mal_id)
+            elif from_start:
+                full.append(mal_id)
+            else:
+                partial.append(mal_id)
+            position += 1
+
+        # Exact title matches first, then names starting with the query, then
+        # names with a word starting with it, each by MAL popularity
+        mal_ids = []
+        for group in (exact, full, partial):
+            for mal_id in sorted(set(group), key=lambda mal_id: self.popularity[mal_id]):
+                if mal_id not in mal_ids:
+                    mal_ids.append(mal_id)
+        return [self.results[mal_id] for mal_id in mal_ids[:limit]]
+
+
+def build_prefix_index(backend):
+    # Scans the whole table, only the publisher should ever call this
+    return PrefixIndex(backend.scan(SEARCH_INDEX_ATTRIBUTES))
+
+
+def publish_prefix_index(backend, bucket=None, key=None):
+    # Builds the index from "anime-cache" and uploads the titles it holds
+    index = build_prefix_index(backend)
+    body = gzip.compress(dumps({
+        'built_at': index.built_at,
+        'items': index.items
+    }, separators=(',', ':')).encode('utf-8'), mtime=0)
+    with metrics.timer('S3'):
+        get_client('s3').put_object(
+            Bucket=bucket or searchIndexBucket,
+            Key=key or searchIndexKey,
+            Body=body,
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+    metrics.increment('S3BytesWritten', len(body))
+    return index
+
+
+def load_prefix_index(etag=None, bucket=None, key=None):
+    # Downloads the published index. Returns None when nothing was published
+    # yet, or when it is unchanged since the copy with `etag`.
+    from botocore.exceptions import ClientError
+
+    kwargs = {'IfNoneMatch': etag} if etag != None else {}
+    try:
+        with metrics.timer('S3'):
+            response = get_client('s3').get_object(Bucket=bucket or searchIndexBucket, Key=key or searchIndexKey, **kwargs)
+            body = response['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('304', '404', 'NoSuchKey', 'NotFound'):
+            raise e
+        return None
+
+    document = json.loads(gzip.decompress(body))
+    return PrefixIndex(document['items'], document['built_at'], response.get('ETag'))
@@ -0,0 +1,98 @@
+import json
+import os
+import zlib
+from decimal import Decimal
+
+from .convert import convert_floats_to_decimals, dumps
+
+# "full" stores every field as its own attribute, "compact" keeps the hot fields
+# as attributes and packs everything else into one compressed binary attribute
+storageFormat = os.environ.get('ANIME_CACHE_STORAGE_FORMAT', 'full')
+
+# Small fields that list views and the freshness checks read directly
+HOT_FIELDS = [
+    'mal_id',
+    'title',
+    'title_english',
+    'url',
+    'image_url',
+    'type',
+    'status',
+    'score',
+    'popularity',
+    'ttl',
+    'soft_expiry',
+]
+PACKED_ATTRIBUTE = 'packed'
+COMPACT_FORMAT = 'zlib-json'
+
+
+def encode_item(anime_details, storage_format=None):
+    if storage_format == None:
+        storage_format = storageFormat
+    if storage_format == 'full':
+        return convert_floats_to_decimals(anime_details)
+    if storage_format != 'compact':
+        raise ValueError(f'Unknown anime cache storage format "{storage_format}"')
+
+    item = convert_floats_to_decimals({k: v for k, v in anime_details.items() if k in HOT_FIELDS})
+    rest = {k: v for k, v in anime_details.items() if k not in HOT_FIELDS}
+    item['storage_format'] = COMPACT_FORMAT
+    item[PACKED_ATTRIBUTE] = zlib.compress(dumps(rest, separators=(',', ':')).encode('utf-8'))
+    return item
+
+
+def decode_item(item):
+    # Reads either format back into the plain dict callers expect. Numbers stay
+    # Decimals, convert.dumps serializes them without another walk over the item.
+    if PACKED_ATTRIBUTE not in item:
+        return item
+
+    anime_details = {
+        k: v for k, v in item.items() if k not in (PACKED_ATTRIBUTE, 'storage_format')
+    }
+    packed = item[PACKED_ATTRIBUTE]
+    # boto3 hands binary attributes back wrapped in boto3.dynamodb.types.Binary
+    packed = getattr(packed, 'value', packed)
+    anime_details.update(json.loads(zlib.decompress(packed)))
+    return anime_details
+
+
+def migrate_items(backend, storage_format, dry_run=False):
+    # Rewrites every complete item in the given format, placeholders holding a
+    # fill lease are left alone. Reads understand both formats throughout. Each
+    # item is only replaced if no fill has touched it since the scan read it.
+    migrated = 0
+    for item in backend.scan():
+        if 'title' not in item or 'lease_until' in item:
+            continue
+        if (PACKED_ATTRIBUTE in item) == (storage_format == 'compact'):
+            continue
+        if dry_run or backend.put_if_unchanged(encode_item(decode_item(item), storage_format), item.get('ttl')):
+            migrated += 1
+    return migrated
+
+
+def dynamodb_item_size(item):
+    # Approximates the size DynamoDB bills for, following
+    # https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/CapacityUnitCalculations.html
+    return sum(len(name.encode('utf-8')) + attribute_size(value) for name, value in item.items())
+
+
+def attribute_size(value):
+    if value == None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(abs(Decimal(str(value)))).replace('.', '').lstrip('0')) or 1
+        return (digits + 1) // 2 + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'value'):
+        return len(value.value)
+    if isinstance(value, dict):
+        return 3 + sum(1 + len(k.encode('utf-8')) + attribute_size(v) for k, v in value.items())
+    if isinstance(value, (list, set, tuple)):
+        return 3 + sum(1 + attribute_size(v) for v in value)
+    return len(str(value).encode('utf-8'))
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+from decimal import Decimal
+from functools import lru_cache
+
+from .clients import get_resource
+from .metrics import metrics
+
+# Every call to MAL goes through one token bucket. MAL_RATE_LIMIT is the most
+# requests per second, 0 turns pacing and the circuit breaker off.
+malRateLimit = float(os.environ.get('MAL_RATE_LIMIT', '4'))
+malRateBurst = float(os.environ.get('MAL_RATE_BURST', '8'))
+# The rate is halved whenever MAL answers 429 and creeps back up on success
+malRateMinimum = float(os.environ.get('MAL_RATE_MINIMUM', '0.25'))
+# Longest a caller waits for a token before giving up on MAL
+malRateMaxWait = float(os.environ.get('MAL_RATE_MAX_WAIT', '10'))
+# After this many failures in a row MAL is left alone for a while
+malCircuitThreshold = int(os.environ.get('MAL_CIRCUIT_THRESHOLD', '5'))
+malCircuitOpenSeconds = float(os.environ.get('MAL_CIRCUIT_OPEN_SECONDS', '60'))
+# Shares the bucket between every lambda when set, otherwise it is per container
+malRateLimitTable = os.environ.get('MAL_RATE_LIMIT_TABLE')
+
+# What a success adds back to a rate lowered by 429s, as a share of the limit
+RATE_INCREASE = 0.02
+
+
+class MalUnavailable(Exception):
+    # Raised instead of calling MAL while the circuit is open or no token came up in time
+    pass
+
+
+def error_status(error):
+    # The HTTP status carried by requests.HTTPError or urllib's HTTPError, if any
+    for status in (getattr(error, 'status_code', None), getattr(error, 'status', None),
+                   getattr(getattr(error, 'response', None), 'status_code', None)):
+        if status != None:
+            return status
+    return None
+
+
+def is_throttled(error):
+    status = error_status(error)
+    if status != None:
+        return status == 429
+    # mal-api doesn't check response codes, it raises a plain Exception with
+    # this message when MAL answers with its rate limit page
+    return 'Temporarily blocked by MyAnimeList' in str(error)
+
+
+def is_outage(error):
+    # Whether an error says MAL itself is struggling: throttling, a 5xx or the
+    # connection failing. Anything else, like mal-api's
+    # ValueError('No such id on MyAnimeList'), is about the request.
+    if is_throttled(error):
+        return True
+    status = error_status(error)
+    if status != None:
+        return status >= 500
+    # requests' exceptions, urllib's URLError and socket timeouts are all OSErrors
+    return isinstance(error, OSError)
+
+
+class LocalThrottleState:
+    # The limiter state shared by the threads of one container
+
+    def __init__(self):
+        self.state = {}
+        self.lock = threading.Lock()
+
+    def update(self, change):
+        # `change` gets a copy of the state and returns (new state or None, result)
+        with self.lock:
+            state, result = change(dict(self.state))
+            if state != None:
+                self.state = state
+            return result
+
+
+class DynamoDBThrottleState:
+    # Keeps the limiter state in a single item, keyed by the string `limiter`, so
+    # every lambda paces against the same budget. Updates are optimistic, guarded
+    # by a version number.
+
+    def __init__(self, table_name, key='mal', dynamodb=None, attempts=5):
+        self.table_name = table_name
+        self.key = key
+        self.dynamodb = dynamodb
+        self.attempts = attempts
+        self.table_resource = None
+
+    @property
+    def table(self):
+        if self.table_resource == None:
+            dynamodb = self.dynamodb if self.dynamodb != None else get_resource('dynamodb')
+            self.table_resource = dynamodb.Table(self.table_name)
+        return self.table_resource
+
+    def update(self, change):
+        for attempt in range(self.attempts):
+            with metrics.timer('DynamoDB'):
+                item = self.table.get_item(
+                    Key={
+                        'limiter': self.key
+                    },
+                    ConsistentRead=True
+                ).get('Item') or {}
+            version = int(item.get('version', 0))
+            state = {k: float(v) for k, v in item.items() if k not in ('limiter', 'version')}
+
+            state, result = change(state)
+            if state == None:
+                return result
+            try:
+                with metrics.timer('DynamoDB'):
+                    self.table.put_item(
+                        Item={
+                            'limiter': self.key,
+                            'version': version + 1,
+                            **{k: Decimal(str(round(v, 6))) for k, v in state.items()}
+                        },
+                        ConditionExpression='attribute_not_exists(#version) OR #version = :version',
+                        ExpressionAttributeNames={
+                            '#version': 'version'
+                        },
+                        ExpressionAttributeValues={
+                            ':version': version
+                        }
+                    )
+                return result
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                # Someone else got in first, start over from their state
+                continue
+        # Heavily contended. An answer that was never saved would hand out
+        # tokens nobody accounted for, so treat it as no token at all.
+        metrics.increment('MALThrottleContention')
+        raise MalUnavailable(f'MAL rate limiter still contended after {self.attempts} attempts')
+
+
+class MalThrottle:
+    # An adaptive token bucket in front of MAL combined with a circuit breaker.
+    # The bucket refills at `rate` tokens a second up to `burst`, and callers
+    # get their tokens first come, first served. Throttling halves the rate
+    # (down to `min_rate`), once for all the requests already sent when it
+    # happened, and successes raise it back towards `rate`.
+    # `threshold` outages in a row open the circuit for `open_seconds`, during
+    # which calls fail right away with MalUnavailable. After that a single
+    # outage reopens it, until a success closes it again.
+
+    def __init__(self, state=None, rate=None, burst=None, min_rate=None, max_wait=None, threshold=None, open_seconds=None):
+        self.state = state if state != None else LocalThrottleState()
+        self.rate = rate if rate != None else malRateLimit
+        self.burst = burst if burst != None else malRateBurst
+        self.min_rate = min_rate if min_rate != None else malRateMinimum
+        self.max_wait = max_wait if max_wait != None else malRateMaxWait
+        self.threshold = threshold if threshold != None else malCircuitThreshold
+        self.open_seconds = open_seconds if open_seconds != None else malCircuitOpenSeconds
+
+    def call(self, function, *args, **kwargs):
+        # Requests scheduled before the rate last went down belong to the
+        # congestion that was already answered, even if they are sent after it
+        reserved_at = time.time()
+        healthy = self.acquire(reserved_at)
+        try:
+            with metrics.timer('MAL'):
+                result = function(*args, **kwargs)
+        except Exception as e:
+            # A bad id says nothing about MAL, only outages count towards the circuit
+            if is_outage(e):
+                self.failed(is_throttled(e), reserved_at)
+            raise
+        # Nothing to reset when everything was healthy as the token was taken
+        if not healthy:
+            self.succeeded()
+        return result
+
+    def acquire(self, now=None):
+        # Returns whether the limiter was healthy, i.e. no failures and the
+        # rate at its limit
+        if now == None:
+            now = time.time()
+        taken = self.state.update(lambda state: self.take(state, now))
+        if taken == None:
+            metrics.increment('MALCircuitOpen')
+            raise MalUnavailable('MAL is failing, not calling it for now')
+        wait, healthy = taken
+        if wait > self.max_wait:
+            metrics.increment('MALRateLimited')
+            raise MalUnavailable(f'No MAL request available within {self.max_wait}s')
+        if wait > 0:
+            time.sleep(wait)
+            metrics.record('MALThrottleWait', wait * 1000, 'Milliseconds')
+        return healthy
+
+    def refill(self, state, now):
+        rate = state.get('rate', self.rate)
+        elapsed = max(0, now - state.get('updated_at', now))
+        tokens = min(self.burst, state.get('tokens', self.burst) + elapsed * rate)
+        return rate, tokens
+
+    def take(self, state, now):
+        # Reserves the next token and returns the seconds until it is due along
+        # with whether the limiter is healthy, or None while the circuit is open. The balance goes negative while
+        # callers wait, so they are let through in the order they asked.
+        # Nothing is reserved when the token is more than max_wait away.
+        if state.get('open_until', 0) > now:
+            return None, None
+        rate, tokens = self.refill(state, now)
+        wait = max(0, (1 - tokens) / rate)
+        healthy = state.get('failures', 0) == 0 and rate >= self.rate
+        if wait > self.max_wait:
+            return None, (wait, healthy)
+        state.update(tokens=tokens - 1, updated_at=now, rate=rate)
+        return state, (wait, healthy)
+
+    def succeeded(self):
+        def change(state):
+            # Nothing to write back while everything is healthy
+            if state.get('failures', 0) == 0 and state.get('rate', self.rate) >= self.rate:
+                return None, None
+            now = time.time()
+            rate, tokens = self.refill(state, now)
+            state.update(
+                tokens=tokens, updated_at=now, failures=0,
+                rate=min(self.rate, rate + self.rate * RATE_INCREASE)
+            )
+            return state, None
+        try:
+            self.state.update(change)
+        except MalUnavailable:
+            # Too contended to record, the next success gets another go
+            pass
+
+    def failed(self, throttled, reserved_at):
+        def change(state):
+            if throttled and reserved_at < state.get('decreased_at', 0):
+                # Scheduled before the last decrease, so part of the congestion
+                # that was already answered. A burst of 429s only halves the rate once.
+                return None, None
+            now = time.time()
+            rate, tokens = self.refill(state, now)
+            if throttled:
+                # MAL wants us to slow down, and the bucket starts over empty
+                # without forgetting the tokens already promised to waiters
+                rate = max(self.min_rate, rate / 2)
+                tokens = min(0, tokens)
+                state['decreased_at'] = now
+            failures = state.get('failures', 0) + 1
+            state.update(tokens=tokens, updated_at=now, rate=rate, failures=failures)
+            opened = failures >= self.threshold
+            if opened:
+                state['open_until'] = now + self.open_seconds
+            return state, (rate, opened)
+
+        metrics.increment('MALThrottled' if throttled else 'MALFailures')
+        try:
+            recorded = self.state.update(change)
+        except MalUnavailable:
+            # Too contended to record, the next failure gets another go
+            return
+        if recorded == None:
+            return
+        rate, opened = recorded
+        metrics.record('MALRate', rate, 'Count/Second')
+        if opened:
+            print(f'MAL keeps failing, pausing calls for {self.open_seconds}s')
+
+
+def create_throttle(name=None):
+    # Mirrors create_backend. The state only goes to DynamoDB when
+    # MAL_RATE_LIMIT_TABLE is set, and nothing is throttled with MAL_RATE_LIMIT=0.
+    if malRateLimit <= 0:
+        return None
+    if name == None:
+        name = os.environ.get('ANIME_CACHE_BACKEND', 'dynamodb')
+
+    if name == 'dynamodb' and malRateLimitTable != None:
+        return MalThrottle(DynamoDBThrottleState(malRateLimitTable))
+    return MalThrottle()
+
+
+@lru_cache(maxsize=None)
+def get_throttle():
+    return create_throttle()
+
+
+def call_mal(function, *args, **kwargs):
+    # Every request to MAL (Anime, AnimeSearch, the forum page) goes through here
+    throttle = get_throttle()
+    if throttle == None:
+        with metrics.timer('MAL'):
+            return function(*args, **kwargs)
+    return throttle.call(function, *args, **kwargs)
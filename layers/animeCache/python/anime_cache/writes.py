@@ -0,0 +1,33 @@
+import threading
+
+from .backends import batchWriteLimit
+
+
+class WriteBuffer:
+    # Groups puts into BatchWriteItem sized chunks. Anything still buffered has
+    # to be written with flush(), e.g. at the end of the handler.
+
+    def __init__(self, backend, flush_size=batchWriteLimit):
+        self.backend = backend
+        self.flush_size = flush_size
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        with self.lock:
+            # A batch can't hold the same key twice, the latest item wins
+            self.items[int(item['mal_id'])] = item
+            full = len(self.items) >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            items = list(self.items.values())
+            self.items = {}
+        if len(items) > 0:
+            self.backend.batch_put(items)
+        return len(items)
@@ -0,0 +1,28 @@
+# Rewrites every anime-cache item in the given storage format. Reads understand
+# both formats, and an item is only replaced if it still has the ttl it was
+# scanned with and no fill lease, so this can run while the lambdas are live.
+# Switch the lambdas' ANIME_CACHE_STORAGE_FORMAT first so new fills are written
+# in the new format, items a fill got to first are already in it.
+#
+#   python scripts/migrate_storage_format.py compact [--dry-run]
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'layers', 'animeCache', 'python'))
+
+from anime_cache import create_backend, migrate_items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('storage_format', choices=['full', 'compact'])
+    parser.add_argument('--dry-run', action='store_true', help='only count the items that would be rewritten')
+    args = parser.parse_args()
+
+    migrated = migrate_items(create_backend(), args.storage_format, args.dry_run)
+    print(f'{"Would rewrite" if args.dry_run else "Rewrote"} {migrated} items as {args.storage_format}')
+
+
+if __name__ == '__main__':
+    main()
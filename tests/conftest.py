@@ -0,0 +1,50 @@
+# Runs the layer and the lambdas against the fakes in benchmarks/stubs.py, the
+# same way benchmarks/lambdas.py drives them offline.
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'animeCache', 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# Read by anime_cache at import time. The tests that need a limiter build
+# their own MalThrottle.
+os.environ.update({
+    'ANIME_CACHE_BACKEND': 'memory',
+    'MAL_RATE_LIMIT': '0',
+    'SEARCH_INDEX_ENABLED': 'false',
+})
+
+import stubs
+
+stubs.configure(mal=0, dynamodb=0, s3=0, sns=0)
+stubs.install()
+
+from anime_cache import cache as cache_module
+
+
+@pytest.fixture(autouse=True)
+def reset_fakes():
+    stubs.configure_mal(limit=None, down=False, requests=0, throttled=0, failed=0)
+    stubs.s3.objects.clear()
+    stubs.sns.messages.clear()
+    yield
+
+
+@pytest.fixture
+def fast_fills(monkeypatch):
+    # Callers that lost a lease poll quickly and give up after a short wait
+    monkeypatch.setattr(cache_module, 'fillWaitSeconds', 0.3)
+    monkeypatch.setattr(cache_module, 'fillPollInterval', 0.02)
+
+
+def load_lambda(name):
+    # Every lambda is a lambda_function.py so load them under their own names
+    path = os.path.join(ROOT, 'lambdas', name, 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location(f'{name}_lambda_function', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
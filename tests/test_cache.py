@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+import stubs
+from anime_cache import AnimeCache, MemoryBackend
+
+
+class Loader:
+    # Stands in for mal.Anime, counting the lookups and failing the given ids
+
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    def __call__(self, mal_id, timeout=5):
+        self.calls.append(mal_id)
+        if mal_id in self.failing:
+            raise ValueError('No such id on MyAnimeList')
+        return stubs.FakeAnime(mal_id)
+
+
+def lease(backend, mal_id, owner='someone else'):
+    now = int(time.time())
+    assert backend.acquire_lease(mal_id, owner, now + 30, now, now + 60)
+
+
+def test_miss_is_fetched_once_and_released():
+    backend = MemoryBackend()
+    loader = Loader()
+    cache = AnimeCache(backend, loader)
+
+    fetched = []
+    assert list(cache.get_or_put_animes([1, 2], fetched=fetched)) == [1, 2]
+    assert sorted(fetched) == [1, 2]
+    assert 'lease_until' not in backend.get(1)
+
+    # Now a plain hit
+    assert cache.get_or_put_anime(1)['mal_id'] == 1
+    assert sorted(loader.calls) == [1, 2]
+
+
+def test_lost_lease_serves_stale_copy():
+    backend = MemoryBackend()
+    now = int(time.time())
+    backend.put({'mal_id': 1, 'title': 'Stale', 'ttl': now + 600, 'soft_expiry': now - 60})
+    lease(backend, 1)
+    loader = Loader()
+    cache = AnimeCache(backend, loader)
+
+    fetched = []
+    animes = cache.get_or_put_animes([1], ['mal_id', 'title'], {}, fetched)
+    assert animes[1]['title'] == 'Stale'
+    assert fetched == []
+    assert loader.calls == []
+
+
+def test_lost_lease_waits_for_the_holder(fast_fills):
+    backend = MemoryBackend()
+    lease(backend, 1)
+    loader = Loader()
+    cache = AnimeCache(backend, loader)
+
+    def fill():
+        time.sleep(0.05)
+        backend.put({'mal_id': 1, 'title': 'Filled elsewhere', 'ttl': int(time.time()) + 600})
+    threading.Thread(target=fill).start()
+
+    assert cache.get_or_put_anime(1)['title'] == 'Filled elsewhere'
+    assert loader.calls == []
+
+
+def test_lost_lease_is_taken_over_after_waiting(fast_fills):
+    backend = MemoryBackend()
+    lease(backend, 1)
+    loader = Loader()
+    cache = AnimeCache(backend, loader)
+
+    started = time.time()
+    fetched = []
+    animes = cache.get_or_put_animes([1], errors={}, fetched=fetched)
+    assert time.time() - started >= 0.3
+    assert animes[1]['mal_id'] == 1
+    assert fetched == [1]
+    assert loader.calls == [1]
+
+
+def test_failed_fetch_releases_the_lease():
+    backend = MemoryBackend()
+    cache = AnimeCache(backend, Loader(failing=[2]))
+
+    errors = {}
+    assert list(cache.get_or_put_animes([1, 2], errors=errors)) == [1]
+    assert isinstance(errors[2], ValueError)
+    assert 'lease_until' not in backend.get(2)
+
+    # Without an errors dict the failure is raised, and the lease still released
+    with pytest.raises(ValueError):
+        AnimeCache(backend, Loader(failing=[3])).get_or_put_anime(3)
+    assert 'lease_until' not in backend.get(3)
+    lease(backend, 3)
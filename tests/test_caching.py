@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import stubs
+from anime_cache import MalUnavailable
+from conftest import load_lambda
+
+TOPIC_ARN = 'arn:aws:sns:us-east-1:000000000000:CacheAnimeTopic'
+
+
+class Context:
+    # Hands out the remaining times in turn, the last one for good
+
+    def __init__(self, *remaining):
+        self.remaining = list(remaining)
+
+    def get_remaining_time_in_millis(self):
+        if len(self.remaining) > 1:
+            return self.remaining.pop(0)
+        return self.remaining[0]
+
+
+def sns_event(mal_ids, attempt=None):
+    message = {'mal_ids': mal_ids}
+    if attempt != None:
+        message['attempt'] = attempt
+    return {'Records': [{'Sns': {'Message': json.dumps(message)}}]}
+
+
+@pytest.fixture
+def caching(monkeypatch):
+    monkeypatch.setenv('CacheAnimeTopic', TOPIC_ARN)
+    module = load_lambda('animeCaching')
+    monkeypatch.setattr(module, 'cachingChunkSize', 2)
+    monkeypatch.setattr(module, 'cachingReserveMillis', 1000)
+    return module
+
+
+def test_ids_that_dont_fit_are_republished(caching):
+    response = caching.lambda_handler(sns_event([1, 2, 3, 4, 5]), Context(60000, 0))
+    body = json.loads(response['body'])
+    assert body['cached'] == [1, 2]
+    assert body['deferred'] == [3, 4, 5]
+
+    [(topic, message)] = stubs.sns.messages
+    assert topic == TOPIC_ARN
+    assert json.loads(message) == {'mal_ids': [3, 4, 5], 'attempt': 1}
+
+
+def test_ids_past_max_attempts_are_dropped(caching):
+    attempt = caching.cachingMaxAttempts
+    response = caching.lambda_handler(sns_event([1, 2, 3], attempt), Context(60000, 0))
+    body = json.loads(response['body'])
+    assert body['deferred'] == []
+    assert body['dropped'] == [3]
+    assert stubs.sns.messages == []
+
+
+def test_unavailable_mal_fails_the_invocation_without_republishing(caching, monkeypatch):
+    def unavailable(mal_id, timeout=5):
+        raise MalUnavailable('MAL is failing, not calling it for now')
+    monkeypatch.setattr(caching.cache, 'loader', unavailable)
+
+    with pytest.raises(MalUnavailable):
+        caching.lambda_handler(sns_event([1, 2, 3]), Context(60000))
+    assert stubs.sns.messages == []
+    # Nothing is left leased for the retry to wait on
+    assert all('lease_until' not in item for item in caching.cache.backend.items.values())
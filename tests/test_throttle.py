@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from anime_cache import MalThrottle, MalUnavailable
+from stubs import HTTPError
+
+
+def fail(status):
+    raise HTTPError(status)
+
+
+def throttle():
+    return MalThrottle(rate=1000, burst=1000, min_rate=1, threshold=2, open_seconds=0.2)
+
+
+def test_circuit_opens_after_outages_and_closes_on_success():
+    mal = throttle()
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            mal.call(fail, 503)
+
+    calls = []
+    with pytest.raises(MalUnavailable):
+        mal.call(calls.append, 'open')
+    assert calls == []
+
+    time.sleep(0.25)
+    assert mal.call(lambda: 'ok') == 'ok'
+    assert mal.state.state['failures'] == 0
+    mal.call(calls.append, 'closed')
+    assert calls == ['closed']
+
+
+def test_single_outage_reopens_circuit_until_a_success():
+    mal = throttle()
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            mal.call(fail, 503)
+
+    time.sleep(0.25)
+    with pytest.raises(HTTPError):
+        mal.call(fail, 503)
+    with pytest.raises(MalUnavailable):
+        mal.call(lambda: 'ok')
+
+
+def test_bad_requests_dont_open_circuit():
+    mal = throttle()
+
+    def missing():
+        raise ValueError('No such id on MyAnimeList')
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            mal.call(missing)
+    assert mal.call(lambda: 'ok') == 'ok'
+
+
+def test_burst_of_throttling_halves_rate_once():
+    mal = MalThrottle(rate=8, burst=8, min_rate=1, threshold=100)
+    reserved_at = time.time()
+    mal.acquire(reserved_at)
+    mal.acquire(reserved_at)
+    mal.failed(True, reserved_at)
+    mal.failed(True, reserved_at)
+    assert mal.state.state['rate'] == 4